@@ -0,0 +1,198 @@
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+
+from ansible.plugins.callback import CallbackBase
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+---
+name: api_metrics
+type: aggregate
+short_description: Report how a play spent its time talking to the AlwaysData API
+description: |
+    Aggregates the API requests returned by the tasks of this collection when their 'metrics'
+    option is set, and reports at the end of each play the number of requests, the bytes
+    exchanged, the latency percentiles, the retries and the agent cache hits, per route, per
+    task and per domain. The reports of every play can also be written as JSON with 'output'.
+version_added: "0.0.1"
+author:
+    - Christophe Henry (@christophehenry)
+requirements:
+    - Enable the callback with 'callbacks_enabled' in the configuration.
+    - Set E(ALWAYSDATA_METRICS=true) or the 'metrics' option of the modules.
+options:
+    output:
+        description: |
+            Path of a JSON file to write the reports to, at the end of the playbook, as a
+            'plays' list holding the report of each play with its name.
+        type: path
+        env:
+            - name: ALWAYSDATA_METRICS_OUTPUT
+        ini:
+            - section: callback_alwaysdata_api_metrics
+              key: output
+    top:
+        description: Number of routes, tasks and domains shown in each section of the report.
+        type: int
+        default: 10
+        env:
+            - name: ALWAYSDATA_METRICS_TOP
+        ini:
+            - section: callback_alwaysdata_api_metrics
+              key: top
+"""
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of ``values``, which must be sorted."""
+    if not values:
+        return 0
+    index = max(0, -(-rank * len(values) // 100) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def summarize(requests):
+    latencies = sorted(it["elapsed"] for it in requests)
+    return {
+        "requests": len(requests),
+        "bytes_sent": sum(it["bytes_sent"] for it in requests),
+        "bytes_received": sum(it["bytes_received"] for it in requests),
+        "elapsed": round(sum(latencies), 6),
+        "retries": sum(it["retries"] for it in requests),
+        "cache_hits": sum(1 for it in requests if it["source"] == "agent_cache"),
+        "errors": sum(1 for it in requests if not 200 <= it["status"] < 400),
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def aggregate(requests):
+    """Builds the report of a list of requests annotated with their ``task`` and ``domain``."""
+    groups = {"routes": {}, "tasks": {}, "domains": {}}
+    for request in requests:
+        groups["routes"].setdefault("{} {}".format(request["method"], request["route"]), []).append(
+            request
+        )
+        groups["tasks"].setdefault(request["task"], []).append(request)
+        if request.get("domain"):
+            groups["domains"].setdefault(request["domain"], []).append(request)
+
+    report = {"total": summarize(requests)}
+    for section, group in groups.items():
+        report[section] = dict(
+            sorted(
+                ((key, summarize(value)) for key, value in group.items()),
+                key=lambda it: -it[1]["elapsed"],
+            )
+        )
+    return report
+
+
+def format_bytes(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return "{:.0f} {}".format(size, unit) if unit == "B" else "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} GiB".format(size)
+
+
+def format_summary(summary):
+    line = (
+        "{} requests, {:.2f}s, p50 {:.3f}s, p90 {:.3f}s, p99 {:.3f}s, {} sent, {} received".format(
+            summary["requests"],
+            summary["elapsed"],
+            summary["p50"],
+            summary["p90"],
+            summary["p99"],
+            format_bytes(summary["bytes_sent"]),
+            format_bytes(summary["bytes_received"]),
+        )
+    )
+    for key, label in (("retries", "retries"), ("cache_hits", "cache hits"), ("errors", "errors")):
+        if summary[key]:
+            line += ", {} {}".format(summary[key], label)
+    return line
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "christophehenry.alwaysdata.api_metrics"
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.play = None
+        self.requests = []
+        self.reports = []
+
+    def collect(self, result):
+        task = result._task.get_name()
+        host = result._host.get_name()
+        results = result._result.get("results")
+        for item in results if isinstance(results, list) else [result._result]:
+            metrics = item.get("alwaysdata_metrics") if isinstance(item, dict) else None
+            if not metrics:
+                continue
+            for request in metrics.get("requests", []):
+                self.requests.append(
+                    {**request, "task": task, "host": host, "domain": metrics.get("domain")}
+                )
+
+    def v2_runner_on_ok(self, result):
+        self.collect(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.collect(result)
+
+    def v2_playbook_on_play_start(self, play):
+        self.report()
+        self.play = play.get_name()
+
+    def v2_playbook_on_stats(self, stats):
+        self.report()
+        self.write()
+
+    def report(self):
+        """Displays the report of the current play, if it made any request, and starts over."""
+        if not self.requests:
+            return
+
+        report = aggregate(self.requests)
+        self.reports.append({"play": self.play, **report})
+        self.requests = []
+        top = self.get_option("top")
+
+        self._display.banner(
+            "ALWAYSDATA API METRICS [{}]".format(self.play)
+            if self.play
+            else "ALWAYSDATA API METRICS"
+        )
+        self._display.display(format_summary(report["total"]))
+        for section, title in (("routes", "Routes"), ("tasks", "Tasks"), ("domains", "Domains")):
+            if not report[section]:
+                continue
+            self._display.display("\n{} by time spent:".format(title))
+            for key, summary in list(report[section].items())[:top]:
+                self._display.display("  {}: {}".format(key, format_summary(summary)))
+
+    def write(self):
+        output = self.get_option("output")
+        if not output or not self.reports:
+            return
+        try:
+            with open(output, "w") as stream:
+                json.dump({"plays": self.reports}, stream, indent=2)
+        except OSError as e:
+            self._display.warning(
+                "Unable to write the AlwaysData API metrics to {}: {}".format(output, e)
+            )
+        else:
+            self._display.display(
+                "\nAlwaysData API metrics written to {}".format(os.path.abspath(output))
+            )
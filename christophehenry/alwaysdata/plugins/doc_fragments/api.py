@@ -0,0 +1,97 @@
+class ModuleDocFragment(object):
+    # Options shared by every module talking to the AlwaysData API
+    DOCUMENTATION = r"""
+options:
+    agent:
+        description: |
+            Send the API requests through a per-user background agent, listening on a Unix socket
+            in '~/.ansible/cp/', instead of opening a new HTTPS connection for each task. The agent
+            is started by the first task needing it. It keeps the connections to the API open and
+            caches listings until a write is made through it or 'agent_cache_ttl' expires. It can
+            also be enabled with the E(ALWAYSDATA_AGENT) environment variable.
+        required: false
+        type: bool
+        default: false
+    agent_idle_timeout:
+        description: Number of seconds without request after which the agent exits.
+        required: false
+        type: int
+        default: 300
+    agent_cache_ttl:
+        description: |
+            Number of seconds the agent serves a cached listing for. Changes made outside of the
+            agent, like in the administration interface, are seen after at most this delay.
+        required: false
+        type: int
+        default: 60
+    connect_timeout:
+        description: |
+            Number of seconds allowed to connect to the API and receive the headers of a response.
+            It can also be set with the E(ALWAYSDATA_CONNECT_TIMEOUT) environment variable.
+        required: false
+        type: int
+        default: 10
+    read_timeout:
+        description: |
+            Number of seconds allowed without receiving data while the body of a response is
+            read. It can also be set with the E(ALWAYSDATA_READ_TIMEOUT) environment variable.
+        required: false
+        type: int
+        default: 30
+    task_timeout:
+        description: |
+            Number of seconds the whole task may spend talking to the API, shared by all of its
+            requests, including the ones retried without the agent. Every timeout is shortened to
+            the time left, and once it is spent the task fails without sending further requests,
+            returning the writes it already made in 'completed'. The task is not bounded when
+            unset. It can also be set with the E(ALWAYSDATA_TASK_TIMEOUT) environment variable.
+        required: false
+        type: int
+    metrics:
+        description: |
+            Return the API requests made by the task, with their route, status, size, latency,
+            retries and whether the agent served them from its cache, in 'alwaysdata_metrics'.
+            The 'christophehenry.alwaysdata.api_metrics' callback aggregates them over a play.
+            It can also be enabled with the E(ALWAYSDATA_METRICS) environment variable.
+        required: false
+        type: bool
+        default: false
+    mirror:
+        description: |
+            Path to a SQLite database mirroring the domains and records of the account. It is
+            refreshed by every listing and updated when records are created, updated or deleted.
+            Query it with the 'christophehenry.alwaysdata.mirror' lookup. It can also be set with
+            the E(ALWAYSDATA_MIRROR) environment variable.
+        required: false
+        type: path
+    cassette:
+        description: |
+            Path to a cassette file to record the API traffic to, or to replay it from, depending
+            on 'cassette_mode'. The token is never written to the cassette. It can also be set
+            with the E(ALWAYSDATA_CASSETTE) environment variable.
+        required: false
+        type: path
+    cassette_mode:
+        description: |
+            With 'record', requests are sent to the API and appended to the cassette with their
+            response and latency. With 'replay', requests are answered from the cassette without
+            any network call; remove the '.state' file next to the cassette to replay it from the
+            start. It can also be set with the E(ALWAYSDATA_CASSETTE_MODE) environment variable.
+        required: false
+        type: str
+        choices:
+        - record
+        - replay
+        default: replay
+    cassette_timing:
+        description: |
+            When replaying, 'original' waits for the recorded latency of each request and 'none'
+            answers immediately. It can also be set with the E(ALWAYSDATA_CASSETTE_TIMING)
+            environment variable.
+        required: false
+        type: str
+        choices:
+        - none
+        - original
+        default: none
+"""
@@ -0,0 +1,107 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+
+from ansible.errors import AnsibleLookupError
+from ansible.plugins.lookup import LookupBase
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.mirror import (
+    RecordMirror,
+)
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+---
+name: mirror
+short_description: Query the local SQLite mirror of an AlwaysData account
+description: |
+    Runs indexed queries against the mirror maintained by the modules of this collection when
+    their 'mirror' option is set. The mirror is read on the controller, so the modules should
+    maintain it from the controller too, for instance with 'delegate_to: localhost'.
+
+    The lookup fails when the mirror may be stale, which happens when a write could not be
+    mirrored, until the records are listed again.
+version_added: "0.0.1"
+author:
+    - Christophe Henry (@christophehenry)
+options:
+    _terms:
+        description: Not used.
+        required: false
+    path:
+        description: Path to the mirror database.
+        required: true
+        type: path
+    domain:
+        description: Only return records of this domain.
+        type: str
+    name:
+        description: Only return records with this host name.
+        type: str
+    type:
+        description: Only return records of this type.
+        type: str
+    value:
+        description: Only return records with this value.
+        type: str
+    with_types:
+        description: |
+            Instead of records, return the names having a record of each of these types, as
+            '{domain, name}' dicts. For instance '[A, CNAME]' finds CNAME conflicts.
+        type: list
+        elements: str
+"""
+
+EXAMPLES = r"""
+- name: Finding the records pointing at an IP
+  ansible.builtin.debug:
+    msg: "{{ query('christophehenry.alwaysdata.mirror', path='/tmp/alwaysdata.db',
+                   value='128.45.87.69') }}"
+
+- name: Finding names with both A and CNAME records
+  ansible.builtin.debug:
+    msg: "{{ query('christophehenry.alwaysdata.mirror', path='/tmp/alwaysdata.db',
+                   with_types=['A', 'CNAME']) }}"
+"""
+
+RETURN = r"""
+_raw:
+    description: |
+        The matching records, with an extra 'domain_name' key, or the matching names when
+        'with_types' is set.
+    type: list
+    elements: dict
+"""
+
+
+class LookupModule(LookupBase):
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        path = self.get_option("path")
+        if not os.path.exists(path):
+            raise AnsibleLookupError("Mirror {} does not exist".format(path))
+
+        with RecordMirror(path) as mirror:
+            if not mirror.is_fresh():
+                raise AnsibleLookupError(
+                    "Mirror {} is stale: list the account again, for instance with a "
+                    "'christophehenry.alwaysdata.snapshot' task using it, before querying "
+                    "it".format(path)
+                )
+
+            if self.get_option("with_types"):
+                return [
+                    {"domain": domain, "name": name}
+                    for domain, name in mirror.names_with_types(
+                        self.get_option("with_types"), domain=self.get_option("domain")
+                    )
+                ]
+
+            return mirror.query(
+                domain=self.get_option("domain"),
+                name=self.get_option("name"),
+                type=self.get_option("type"),
+                value=self.get_option("value"),
+            )
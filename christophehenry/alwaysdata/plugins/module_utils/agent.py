@@ -0,0 +1,367 @@
+"""Per-user background agent keeping HTTPS connections and API listings warm between tasks.
+
+Every module invocation is a short-lived process. When the ``agent`` option is enabled,
+``api_query`` sends its requests to an agent listening on a Unix socket instead of opening a new
+HTTPS connection. The agent is forked by the first module needing it, reuses keep-alive
+connections to the API, caches successful ``GET`` responses until a write is made to the same
+route family or ``cache_ttl`` expires, and exits after ``idle_timeout`` seconds without request,
+much like SSH's ``ControlPersist``.
+
+Requests and responses are exchanged as one JSON document per line.
+"""
+
+import base64
+import errno
+import fcntl
+import hashlib
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.compression import (
+    ACCEPT_ENCODING,
+    read_text,
+)
+
+API_HOST = "api.alwaysdata.com"
+API_PREFIX = "/v1"
+
+
+def socket_path():
+    directory = os.path.join(os.path.expanduser("~"), ".ansible", "cp")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, "alwaysdata-agent-{}.sock".format(os.getuid()))
+
+
+class ConnectionPool(object):
+    """Keeps idle keep-alive HTTPS connections to the API for reuse."""
+
+    def __init__(self, host, timeout=30, size=4):
+        self.host = host
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def request(
+        self,
+        method,
+        url,
+        body=None,
+        headers=None,
+        stats=None,
+        connect_timeout=None,
+        read_timeout=None,
+    ):
+        """Sends a request and returns its status, headers and decompressed payload.
+
+        The timeouts default to the pool's one. The number of retries is stored in ``stats`` when
+        it is provided.
+        """
+        for attempt in range(2):
+            if stats is not None:
+                stats["retries"] = attempt
+            try:
+                connection, reused = self.idle.get_nowait(), True
+            except queue.Empty:
+                connection, reused = (
+                    http.client.HTTPSConnection(self.host, timeout=self.timeout),
+                    False,
+                )
+
+            try:
+                # Like fetch_url, connect_timeout covers the connection and the response headers
+                # and read_timeout the reads of the body
+                connection.timeout = self.timeout if connect_timeout is None else connect_timeout
+                if connection.sock is None:
+                    connection.connect()
+                connection.sock.settimeout(connection.timeout)
+                connection.request(method, url, body=body, headers=headers or {})
+                response = connection.getresponse()
+                connection.sock.settimeout(self.timeout if read_timeout is None else read_timeout)
+                payload = read_text(response, response.getheader("Content-Encoding"))
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                # The server closed an idle connection: retry once on a new one, unless the
+                # request was not idempotent.
+                if reused and method != "POST" and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    self.idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+
+            response_headers = {
+                key: value
+                for key, value in response.getheaders()
+                # The payload is returned decompressed
+                if key.lower() not in ("content-encoding", "content-length")
+            }
+            return response.status, response_headers, payload
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ResponseCache(object):
+    """Successful ``GET`` responses, per token and route.
+
+    A write on ``/record/1234/`` invalidates every cached route of the same token starting with
+    ``/record/``.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def family(route):
+        return "/{}/".format(route.strip("/").split("/")[0])
+
+    def get(self, token_key, route):
+        with self.lock:
+            entry = self.entries.get((token_key, route))
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                return None
+            return entry[1]
+
+    def set(self, token_key, route, response):
+        with self.lock:
+            self.entries[(token_key, route)] = (time.monotonic(), response)
+
+    def invalidate(self, token_key, route):
+        family = self.family(route)
+        with self.lock:
+            for key in [
+                key for key in self.entries if key[0] == token_key and key[1].startswith(family)
+            ]:
+                del self.entries[key]
+
+
+class AgentServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, idle_timeout, cache_ttl, host=API_HOST):
+        super().__init__(path, AgentRequestHandler)
+        os.chmod(path, 0o600)
+        self.idle_timeout = idle_timeout
+        self.pool = ConnectionPool(host)
+        self.cache = ResponseCache(cache_ttl)
+        self.last_activity = time.monotonic()
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def watch_idle(self):
+        while time.monotonic() - self.last_activity < self.idle_timeout:
+            time.sleep(min(1, self.idle_timeout))
+        self.shutdown()
+
+    def forward(self, request):
+        token = request["token"]
+        token_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        method = request.get("method", "GET")
+        route = request["route"]
+
+        if method == "GET":
+            cached = self.cache.get(token_key, route)
+            if cached is not None:
+                return {**cached, "cached": True}
+
+        headers = dict(request.get("headers") or {})
+        headers["Accept-Encoding"] = ACCEPT_ENCODING
+        headers["Authorization"] = "Basic {}".format(
+            base64.b64encode("{}:".format(token).encode("utf-8")).decode("ascii")
+        )
+        data = request.get("data")
+        stats = {}
+        status, response_headers, payload = self.pool.request(
+            method,
+            API_PREFIX + route,
+            body=data.encode("utf-8") if data is not None else None,
+            headers=headers,
+            stats=stats,
+            connect_timeout=request.get("connect_timeout"),
+            read_timeout=request.get("read_timeout"),
+        )
+        response = {
+            "status": status,
+            "headers": {k.lower(): v for k, v in response_headers.items()},
+            "body": payload,
+        }
+
+        if method == "GET":
+            if status == 200:
+                self.cache.set(token_key, route, response)
+        else:
+            self.cache.invalidate(token_key, route)
+
+        response = {**response, "cached": False}
+        if stats.get("retries"):
+            response["retries"] = stats["retries"]
+        return response
+
+
+class AgentRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.touch()
+        line = self.rfile.readline()
+        if not line:
+            # Liveness probe
+            return
+        try:
+            response = self.server.forward(json.loads(line))
+        except Exception as e:
+            response = {"error": "{}: {}".format(type(e).__name__, e)}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+        self.server.touch()
+
+
+def serve(path, idle_timeout, cache_ttl):
+    """Runs the agent in the current process until it has been idle for ``idle_timeout``."""
+    with open(path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if ping(path):
+            # Another agent won the race
+            return
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        server = AgentServer(path, idle_timeout, cache_ttl)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    threading.Thread(target=server.watch_idle, daemon=True).start()
+    try:
+        server.serve_forever(poll_interval=0.5)
+    finally:
+        server.server_close()
+        server.pool.close()
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+def ping(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+def spawn(path, idle_timeout, cache_ttl, timeout=5):
+    """Forks a detached agent, if none is listening on ``path``, and waits for it to be ready."""
+    if ping(path):
+        return True
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.setsid()
+            if os.fork() != 0:
+                os._exit(0)
+            # Release the module's stdout/stderr so Ansible doesn't wait for the agent to exit
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            serve(path, idle_timeout, cache_ttl)
+        finally:
+            os._exit(0)
+
+    os.waitpid(pid, 0)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if ping(path):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def agent_request(path, request, timeout=60):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as stream:
+            line = stream.readline()
+    finally:
+        sock.close()
+
+    if not line:
+        raise OSError(errno.ECONNRESET, "Agent closed the connection")
+    return json.loads(line)
+
+
+def agent_query(
+    token,
+    route,
+    *,
+    method,
+    data,
+    headers,
+    idle_timeout,
+    cache_ttl,
+    connect_timeout=None,
+    read_timeout=None,
+    timeout=60,
+    path=None,
+):
+    """Sends a request through the agent, starting it if needed.
+
+    The agent talks to the API with ``connect_timeout`` and ``read_timeout`` while ``timeout``
+    bounds the whole exchange with the agent.
+
+    Returns the agent's response or ``None`` when the agent can't be used, in which case the
+    caller should send the request by itself. Failed writes are returned with an ``error`` key
+    instead since they may have reached the API.
+    """
+    try:
+        path = path or socket_path()
+        if not spawn(path, idle_timeout, cache_ttl):
+            return None
+    except OSError:
+        return None
+
+    try:
+        response = agent_request(
+            path,
+            {
+                "token": token,
+                "route": route,
+                "method": method,
+                "data": data,
+                "headers": headers,
+                "connect_timeout": connect_timeout,
+                "read_timeout": read_timeout,
+            },
+            timeout,
+        )
+    except (OSError, ValueError) as e:
+        response = {"error": str(e)}
+
+    if "error" in response and method == "GET":
+        # Safe to retry without the agent
+        return None
+    return response
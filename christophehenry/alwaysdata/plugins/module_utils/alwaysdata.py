@@ -1,9 +1,66 @@
+import hashlib
+import http.client
 import json
+import os
 import re
-from urllib.error import HTTPError
+import sqlite3
+import tempfile
+import time
+import weakref
+import zlib
 
+from ansible.module_utils.basic import env_fallback
 from ansible.module_utils.urls import fetch_url
 
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.agent import agent_query
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.cassette import Cassette
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.compression import (
+    ACCEPT_ENCODING,
+    decode_bytes,
+    read_text,
+)
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.mirror import (
+    RecordMirror,
+)
+
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+
+
+def api_argument_spec():
+    """Options shared by every module talking to the API."""
+    return dict(
+        agent=dict(type="bool", default=False, fallback=(env_fallback, ["ALWAYSDATA_AGENT"])),
+        agent_idle_timeout=dict(type="int", default=300),
+        agent_cache_ttl=dict(type="int", default=60),
+        connect_timeout=dict(
+            type="int",
+            default=DEFAULT_CONNECT_TIMEOUT,
+            fallback=(env_fallback, ["ALWAYSDATA_CONNECT_TIMEOUT"]),
+        ),
+        read_timeout=dict(
+            type="int",
+            default=DEFAULT_READ_TIMEOUT,
+            fallback=(env_fallback, ["ALWAYSDATA_READ_TIMEOUT"]),
+        ),
+        task_timeout=dict(type="int", fallback=(env_fallback, ["ALWAYSDATA_TASK_TIMEOUT"])),
+        metrics=dict(type="bool", default=False, fallback=(env_fallback, ["ALWAYSDATA_METRICS"])),
+        mirror=dict(type="path", fallback=(env_fallback, ["ALWAYSDATA_MIRROR"])),
+        cassette=dict(type="path", fallback=(env_fallback, ["ALWAYSDATA_CASSETTE"])),
+        cassette_mode=dict(
+            type="str",
+            default="replay",
+            choices=["record", "replay"],
+            fallback=(env_fallback, ["ALWAYSDATA_CASSETTE_MODE"]),
+        ),
+        cassette_timing=dict(
+            type="str",
+            default="none",
+            choices=["none", "original"],
+            fallback=(env_fallback, ["ALWAYSDATA_CASSETTE_TIMING"]),
+        ),
+    )
+
 
 def api_query(
     module,
@@ -17,6 +74,9 @@ def api_query(
     **kwargs,
 ):
     route = re.sub(r"/+", "/", "/{}/".format(route))
+    if deadline_exceeded(module):
+        fail_deadline(module, "before {} {} could be sent".format(method, route))
+
     kwargs.setdefault("headers", {})
     kwargs["headers"].setdefault("Accept", "application/json")
 
@@ -24,35 +84,433 @@ def api_query(
         kwargs["data"] = module.jsonify(data)
         kwargs["headers"]["Content-Type"] = "application/json"
 
-    response, info = fetch_url(
-        module,
-        "https://{}:@api.alwaysdata.com/v1{}".format(token, route),
-        method=method,
-        **kwargs,
-    )
+    started = time.monotonic()
+    cassette = get_cassette(module)
+    response = None
+    source = "network"
+    if cassette is not None and cassette.mode == "replay":
+        try:
+            response = cassette.replay(
+                token,
+                method,
+                route,
+                kwargs.get("data"),
+                max_delay=budget(
+                    module,
+                    module.params.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+                    + module.params.get("read_timeout", DEFAULT_READ_TIMEOUT),
+                ),
+            )
+        except (OSError, ValueError) as e:
+            module.fail_json(msg="Unable to replay cassette {}: {}".format(cassette.path, e))
+        if response is None:
+            module.fail_json(
+                msg="No interaction recorded for {} {} in {}".format(method, route, cassette.path)
+            )
+        if cassette.timing == "original" and deadline_exceeded(module):
+            # The recorded latency didn't fit in the task's budget
+            fail_deadline(module, "while waiting for {} {}".format(method, route))
+        source = "cassette"
+    elif module.params.get("agent"):
+        connect_timeout = module.params.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+        read_timeout = module.params.get("read_timeout", DEFAULT_READ_TIMEOUT)
+        response = agent_query(
+            token,
+            route,
+            method=method,
+            data=kwargs.get("data"),
+            headers=kwargs["headers"],
+            idle_timeout=module.params["agent_idle_timeout"],
+            cache_ttl=module.params["agent_cache_ttl"],
+            connect_timeout=budget(module, connect_timeout),
+            read_timeout=budget(module, read_timeout),
+            timeout=budget(module, connect_timeout + read_timeout),
+        )
+        if (response is None or "error" in response) and deadline_exceeded(module):
+            # The request may or may not have reached the API
+            fail_deadline(module, "while waiting for {} {}".format(method, route))
 
-    if response.status == 401:
+    if response is None:
+        kwargs["timeout"] = budget(
+            module, module.params.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT)
+        )
+        status, response_body, info = _fetch(module, token, route, method=method, **kwargs)
+    else:
+        if source == "network":
+            source = "agent_cache" if response.get("cached") else "agent"
+        info = {"url": route, "status": response.get("status", -1), **response.get("headers", {})}
+        if "error" in response:
+            info["msg"] = response["error"]
+            http_screw_up(module, "The AlwaysData agent failed to forward the request.", info)
+        status, response_body = response["status"], response["body"]
+        info["body"] = response_body
+
+    if cassette is not None and cassette.mode == "record":
+        error_body = info.get("body")
+        if isinstance(error_body, bytes):
+            error_body = error_body.decode("utf-8", "replace")
+        try:
+            cassette.record(
+                token,
+                method,
+                route,
+                kwargs.get("data"),
+                status,
+                {k: info[k] for k in ("content-type",) if k in info},
+                response_body if response_body is not None else error_body,
+                time.monotonic() - started,
+            )
+        except (OSError, ValueError) as e:
+            module.fail_json(msg="Unable to record cassette {}: {}".format(cassette.path, e))
+
+    if module.params.get("metrics"):
+        received = info.get("bytes_received")
+        if received is None:
+            received = len((response_body or "").encode("utf-8"))
+        task_state(module)["requests"].append(
+            {
+                "method": method,
+                "route": route_family(route),
+                "status": status,
+                "source": source,
+                "bytes_sent": len(kwargs["data"].encode("utf-8")) if data is not None else 0,
+                "bytes_received": received,
+                "elapsed": round(time.monotonic() - started, 6),
+                "retries": (response or {}).get("retries", 0),
+            }
+        )
+
+    if status == -1 and deadline_exceeded(module):
+        # The request may or may not have reached the API
+        fail_deadline(module, "while waiting for {} {}".format(method, route))
+
+    if status == 401:
         http_screw_up(module, "Got unauthorized response: bad token provided", info)
 
-    if 500 <= response.status < 600:
+    if 500 <= status < 600:
         http_screw_up(module, "The AlwaysData HTTP API has a problem. Retry later", info)
 
-    if isinstance(response, HTTPError):
+    if not 200 <= status < 400:
         http_screw_up(module, "Unexpected server error.", info)
 
-    if expected_status and response.status != expected_status:
+    if expected_status and status != expected_status:
         http_screw_up(module, fail_msg, info)
 
-    response_body = response.read().decode("utf-8")
+    if method != "GET":
+        task_state(module)["completed"].append({"method": method, "route": route.strip("/")})
+
     return json.loads(response_body) if response_body else None
 
 
+def _fetch(module, token, route, **kwargs):
+    kwargs["headers"] = {"Accept-Encoding": ACCEPT_ENCODING, **kwargs["headers"]}
+    response, info = fetch_url(
+        module,
+        "https://{}:@api.alwaysdata.com/v1{}".format(token, route),
+        decompress=False,
+        **kwargs,
+    )
+    encoding = info.get("content-encoding")
+
+    if response is None or not 200 <= info["status"] < 400:
+        # Connection errors and HTTP errors: fetch_url already stored the body in info
+        if encoding and isinstance(info.get("body"), bytes):
+            try:
+                info["body"] = decode_bytes(info["body"], encoding)
+            except (ValueError, zlib.error):
+                pass
+        return info["status"], None, info
+
+    stream = BudgetedStream(module, response)
+    try:
+        # Decompressed while it is downloaded, or read as is if the server didn't compress it
+        text = read_text(stream, encoding)
+        info["bytes_received"] = stream.bytes_read
+        return info["status"], text, info
+    except (ValueError, zlib.error) as e:
+        info["msg"] = str(e)
+        http_screw_up(module, "Unable to decode the server's response.", info)
+    except OSError as e:
+        if deadline_exceeded(module):
+            fail_deadline(module, "while reading the response to {}".format(route))
+        info["msg"] = str(e)
+        http_screw_up(module, "Unable to read the server's response.", info)
+
+
 def http_screw_up(module, msg, info):
     kwargs = {"msg": msg}
     if module._verbosity >= 3:
         kwargs["debug"] = info
-    module.fail_json(**kwargs)
+    completed = task_state(module)["completed"]
+    if completed:
+        kwargs["completed"] = completed
+    module.fail_json(**with_metrics(module, kwargs))
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~ Time budget ~~~~~~~~~~~~~~~~~~~~~~~ #
+
+_TASKS = weakref.WeakKeyDictionary()
+
+
+def task_state(module):
+    """Returns the state shared by all the API calls of the task run by ``module``.
+
+    The task's clock starts with its first call.
+    """
+    if module not in _TASKS:
+        _TASKS[module] = {"started": time.monotonic(), "completed": [], "requests": []}
+    return _TASKS[module]
+
+
+def deadline_remaining(module):
+    """Returns the number of seconds left before the 'task_timeout' or ``None`` without one."""
+    task_timeout = module.params.get("task_timeout")
+    if task_timeout is None:
+        return None
+    return task_timeout - (time.monotonic() - task_state(module)["started"])
+
+
+def deadline_exceeded(module):
+    remaining = deadline_remaining(module)
+    return remaining is not None and remaining <= 0
+
+
+def budget(module, timeout):
+    """Bounds ``timeout`` by the time left to the task."""
+    remaining = deadline_remaining(module)
+    return timeout if remaining is None else max(0, min(timeout, remaining))
+
+
+def fail_deadline(module, when):
+    """Fails the task once its time budget is spent, with the writes it already completed."""
+    module.fail_json(
+        **with_metrics(
+            module,
+            {
+                "msg": "Task timeout of {} seconds exceeded {}.".format(
+                    module.params["task_timeout"], when
+                ),
+                "completed": task_state(module)["completed"],
+            },
+        )
+    )
+
+
+def response_socket(response):
+    """Returns the socket an ``http.client`` response is read from, or ``None``.
+
+    ``http.client`` has no public accessor for it, so it is reached through the buffered reader
+    of the response; ``TestTimeouts.test_response_socket`` checks this still works.
+    """
+    return getattr(getattr(getattr(response, "fp", None), "raw", None), "_sock", None)
+
+
+class BudgetedStream(object):
+    """Reads an HTTP response with the 'read_timeout' and the time left to the task.
+
+    The timeout applies to each read of the underlying socket, so a stalled response fails
+    after 'read_timeout' seconds and a slow one can't outlive the task's deadline.
+    """
+
+    def __init__(self, module, response):
+        self.module = module
+        self.response = response
+        self.bytes_read = 0
+        self.sock = response_socket(response)
+        state = task_state(module)
+        if (
+            self.sock is None
+            and isinstance(response, http.client.HTTPResponse)
+            and not state.get("read_timeout_warned")
+        ):
+            state["read_timeout_warned"] = True
+            module.warn(
+                "Unable to find the socket of the HTTP response: 'read_timeout' is not enforced."
+            )
+
+    def read(self, size=-1):
+        timeout = budget(self.module, self.module.params.get("read_timeout", DEFAULT_READ_TIMEOUT))
+        if timeout <= 0:
+            raise TimeoutError("Task timeout exceeded")
+        if self.sock is not None:
+            self.sock.settimeout(timeout)
+        chunk = self.response.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+# ~~~~~~~~~~~~~~~~~~~~~~~ Metrics ~~~~~~~~~~~~~~~~~~~~~~~ #
+
+
+def route_family(route):
+    """Replaces the ids in ``route`` so that metrics group the requests by endpoint.
+
+    ``/record/1234/`` becomes ``record/{id}``.
+    """
+    return "/".join("{id}" if part.isdigit() else part for part in route.strip("/").split("/"))
+
+
+def with_metrics(module, result):
+    """Adds the API calls made by the task to ``result`` when the 'metrics' option is set.
+
+    They are returned as 'alwaysdata_metrics' for the 'christophehenry.alwaysdata.api_metrics'
+    callback to aggregate.
+    """
+    if not module.params.get("metrics"):
+        return result
+    return {
+        **result,
+        "alwaysdata_metrics": {
+            "domain": module.params.get("domain"),
+            "requests": task_state(module)["requests"],
+        },
+    }
+
+
+_MIRRORS = {}
+_CASSETTES = {}
+
+
+def get_cassette(module):
+    """Returns the cassette configured with the 'cassette' option, if any."""
+    path = module.params.get("cassette")
+    if not path:
+        return None
+    key = (path, module.params.get("cassette_mode"), module.params.get("cassette_timing"))
+    if key not in _CASSETTES:
+        _CASSETTES[key] = Cassette(*key)
+    return _CASSETTES[key]
+
+
+def get_mirror(module):
+    """Returns the SQLite mirror configured with the 'mirror' option, if any."""
+    path = module.params.get("mirror")
+    if not path:
+        return None
+    if path not in _MIRRORS:
+        try:
+            _MIRRORS[path] = RecordMirror(path)
+        except sqlite3.Error as e:
+            return module.fail_json(msg="Unable to open mirror {}: {}".format(path, e))
+    return _MIRRORS[path]
+
+
+def update_mirror(module, method, /, *args, **kwargs):
+    """Calls ``method`` of the mirror, if any.
+
+    The mirror is only a cache of the API: when it can't be written to, it is marked stale with
+    a warning instead of failing a task which may already have changed the account.
+    """
+    mirror = get_mirror(module)
+    if mirror is None:
+        return
+    try:
+        getattr(mirror, method)(*args, **kwargs)
+    except sqlite3.Error as e:
+        module.warn("Unable to update mirror {}: {}".format(mirror.path, e))
+        try:
+            mirror.invalidate_records()
+        except sqlite3.Error:
+            pass
 
 
 def list_domains(module, token):
-    return api_query(module, token, "domain")
+    domains = api_query(module, token, "domain")
+    update_mirror(module, "sync_domains", domains)
+    return domains
+
+
+def list_records(module, token):
+    records = api_query(module, token, "record")
+    update_mirror(module, "sync_records", records)
+    return records
+
+
+SNAPSHOT_VERSION = 1
+
+
+def dump_json(path, content):
+    """Atomically writes ``content`` as JSON to ``path``."""
+    content = json.dumps(content, indent=2, sort_keys=True)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".alwaysdata-")
+    try:
+        with os.fdopen(fd, "w") as stream:
+            stream.write(content)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def dump_snapshot(path, domains, records):
+    dump_json(path, {"version": SNAPSHOT_VERSION, "domains": domains, "records": records})
+
+
+def load_snapshot(module, path):
+    try:
+        with open(path, "r") as stream:
+            snapshot = json.load(stream)
+    except (OSError, ValueError) as e:
+        return module.fail_json(msg="Unable to read snapshot {}: {}".format(path, e))
+
+    if (
+        not isinstance(snapshot, dict)
+        or snapshot.get("version") != SNAPSHOT_VERSION
+        or not isinstance(snapshot.get("domains"), list)
+        or not isinstance(snapshot.get("records"), list)
+    ):
+        return module.fail_json(
+            msg="Unsupported snapshot format in {}; expected version {}".format(
+                path, SNAPSHOT_VERSION
+            )
+        )
+
+    return snapshot
+
+
+def normalize_record(record):
+    """Keeps the fields of a record that are served by DNS, in a stable form."""
+    return {
+        "type": record["type"],
+        "name": record.get("name") or "",
+        "value": (record.get("value") or "").strip(),
+        "priority": record.get("priority"),
+        "ttl": record.get("ttl"),
+    }
+
+
+def _digest(content):
+    return hashlib.sha256(
+        json.dumps(content, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    ).hexdigest()
+
+
+def record_hashes(domains, records):
+    """Computes per-domain hashes, with per-name sub-hashes, from one listing.
+
+    Returns a dict mapping each domain name to ``{"hash": ..., "names": {...}}`` where every name
+    maps to ``{"hash": ..., "records": [...]}``. Records are normalized and sorted so that the
+    hashes don't depend on the order the API returns them in.
+    """
+    domain_names = {domain["href"]: domain["name"] for domain in domains}
+    grouped = {domain["name"]: {} for domain in domains}
+    for record in records:
+        domain_name = domain_names.get(record["domain"]["href"])
+        if domain_name is None:
+            continue
+        normalized = normalize_record(record)
+        grouped[domain_name].setdefault(normalized["name"], []).append(normalized)
+
+    hashes = {}
+    for domain_name, names in grouped.items():
+        entries = {}
+        for name, name_records in names.items():
+            name_records.sort(key=_digest)
+            entries[name] = {"hash": _digest(name_records), "records": name_records}
+        hashes[domain_name] = {
+            "hash": _digest(sorted((name, entry["hash"]) for name, entry in entries.items())),
+            "names": entries,
+        }
+
+    return hashes
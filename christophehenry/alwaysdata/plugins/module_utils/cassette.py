@@ -0,0 +1,141 @@
+"""Record and replay of the API traffic.
+
+In ``record`` mode every request sent by ``api_query`` is appended, with its response and the
+time it took, to a cassette file in the JSON Lines format: a header line with the format version,
+then one line per interaction, so recording costs the same whatever the size of the cassette. The
+token is never written: requests are stored by route and any occurrence of the token in a body is
+redacted. In ``replay`` mode requests are served from the cassette without any network call,
+either instantly or with their recorded latency, so that a production play can be profiled and
+benchmarked offline. The cassette is read and indexed once per process.
+
+A cassette is shared by all the tasks of a play. Each recorded interaction is replayed once, in
+order, among the interactions with the same request; the replayed positions are appended to a
+``.state`` file next to the cassette, which is removed to replay it from the start. Each process
+keeps the positions it already read and only reads the ones appended since. Once every matching
+interaction was replayed, the last one is served again.
+"""
+
+import contextlib
+import fcntl
+import json
+import time
+
+CASSETTE_VERSION = 2
+REDACTED = "<redacted>"
+
+
+def request_key(method, route, data):
+    return json.dumps([method, route, data])
+
+
+class Cassette(object):
+    def __init__(self, path, mode, timing="none"):
+        self.path = path
+        self.mode = mode
+        self.timing = timing
+        self.index = None
+        self.responses = None
+        self.replayed = set()
+        self.state_offset = 0
+
+    @contextlib.contextmanager
+    def _locked(self):
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _check_header(self, line):
+        try:
+            version = json.loads(line).get("version")
+        except (ValueError, AttributeError):
+            version = None
+        if version != CASSETTE_VERSION:
+            raise ValueError(
+                "Unsupported cassette format in {}; expected version {}".format(
+                    self.path, CASSETTE_VERSION
+                )
+            )
+
+    def interactions(self):
+        try:
+            with open(self.path, "r") as stream:
+                lines = stream.read().splitlines()
+        except FileNotFoundError:
+            return []
+        if not lines:
+            return []
+        self._check_header(lines[0])
+        return [json.loads(line) for line in lines[1:] if line]
+
+    def _load(self):
+        """Indexes the recorded interactions by request, once."""
+        if self.index is None:
+            self.responses = []
+            self.index = {}
+            for position, interaction in enumerate(self.interactions()):
+                request = interaction["request"]
+                key = request_key(request["method"], request["route"], request["data"])
+                self.index.setdefault(key, []).append(position)
+                self.responses.append((interaction["response"], interaction["elapsed"]))
+
+    def record(self, token, method, route, data, status, headers, body, elapsed):
+        interaction = {
+            "request": {"method": method, "route": route, "data": redact(data, token)},
+            "response": {"status": status, "headers": headers, "body": redact(body, token)},
+            "elapsed": round(elapsed, 6),
+        }
+        with self._locked():
+            with open(self.path, "a+") as stream:
+                stream.seek(0)
+                header = stream.readline()
+                if header:
+                    self._check_header(header)
+                else:
+                    stream.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+                stream.write(json.dumps(interaction) + "\n")
+
+    def _read_state(self, state_path):
+        """Adds the positions replayed by other processes since the last read."""
+        try:
+            with open(state_path, "r") as stream:
+                stream.seek(self.state_offset)
+                content = stream.read()
+        except FileNotFoundError:
+            return
+        self.state_offset += len(content)
+        self.replayed.update(int(line) for line in content.splitlines() if line.strip())
+
+    def replay(self, token, method, route, data, max_delay=None):
+        """Returns the recorded response to this request or ``None`` if there is none.
+
+        With ``original`` timing, the recorded latency is capped to ``max_delay`` seconds.
+        """
+        self._load()
+        candidates = self.index.get(request_key(method, route, redact(data, token)))
+        if not candidates:
+            return None
+
+        with self._locked():
+            state_path = self.path + ".state"
+            self._read_state(state_path)
+            position = next((it for it in candidates if it not in self.replayed), candidates[-1])
+            if position not in self.replayed:
+                line = "{}\n".format(position)
+                with open(state_path, "a") as stream:
+                    stream.write(line)
+                self.state_offset += len(line)
+                self.replayed.add(position)
+
+        response, elapsed = self.responses[position]
+        if self.timing == "original":
+            time.sleep(elapsed if max_delay is None else min(elapsed, max_delay))
+        return response
+
+
+def redact(content, token):
+    if content is None or not token:
+        return content
+    return content.replace(token, REDACTED)
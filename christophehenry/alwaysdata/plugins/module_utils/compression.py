@@ -0,0 +1,80 @@
+"""Compressed transfer of API responses.
+
+Listings of DNS records are large and very repetitive JSON documents. Requests advertise
+``ACCEPT_ENCODING`` and responses are decompressed chunk by chunk while they are read, so that the
+compressed payload is never buffered whole. Uncompressed responses are read as is.
+"""
+
+import codecs
+import zlib
+
+ACCEPT_ENCODING = "gzip, deflate"
+CHUNK_SIZE = 64 * 1024
+
+
+class UnsupportedEncoding(ValueError): ...
+
+
+def decompressor(encoding):
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        return None
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        # Some servers send raw deflate streams instead of zlib ones: let zlib detect the header
+        return DeflateDecompressor()
+    raise UnsupportedEncoding("Unsupported Content-Encoding: {}".format(encoding))
+
+
+class DeflateDecompressor(object):
+    """Accepts both zlib-wrapped (RFC 1950) and raw (RFC 1951) deflate streams."""
+
+    def __init__(self):
+        self.decompressobj = None
+
+    def decompress(self, data):
+        if self.decompressobj is None:
+            self.decompressobj = zlib.decompressobj(zlib.MAX_WBITS)
+            try:
+                return self.decompressobj.decompress(data)
+            except zlib.error:
+                self.decompressobj = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self.decompressobj.decompress(data)
+
+    def flush(self):
+        return self.decompressobj.flush() if self.decompressobj else b""
+
+
+def iter_decompressed(stream, encoding, chunk_size=CHUNK_SIZE):
+    """Yields the decompressed content of a file-like ``stream``, one chunk at a time."""
+    decoder = decompressor(encoding)
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = decoder.decompress(chunk) if decoder else chunk
+        if chunk:
+            yield chunk
+    if decoder:
+        tail = decoder.flush()
+        if tail:
+            yield tail
+
+
+def read_text(stream, encoding, charset="utf-8", chunk_size=CHUNK_SIZE):
+    """Reads a possibly compressed ``stream`` into a string ready for the JSON decoder."""
+    text_decoder = codecs.getincrementaldecoder(charset)()
+    parts = [
+        text_decoder.decode(chunk) for chunk in iter_decompressed(stream, encoding, chunk_size)
+    ]
+    parts.append(text_decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+def decode_bytes(data, encoding, charset="utf-8"):
+    """Same as ``read_text`` for a payload that was already read."""
+    decoder = decompressor(encoding)
+    if decoder:
+        data = decoder.decompress(data) + decoder.flush()
+    return data.decode(charset)
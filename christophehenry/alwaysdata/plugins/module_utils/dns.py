@@ -0,0 +1,286 @@
+"""Minimal DNS client used to wait for record propagation.
+
+Only what is needed to ask a nameserver for the records of a name over UDP is implemented here so
+that modules don't require any third party library on the managed host.
+"""
+
+import ipaddress
+import random
+import re
+import select
+import socket
+import struct
+import time
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.validation import (
+    txt_chunks,
+)
+
+QTYPES = {
+    "A": 1,
+    "NS": 2,
+    "CNAME": 5,
+    "PTR": 12,
+    "MX": 15,
+    "TXT": 16,
+    "AAAA": 28,
+    "SRV": 33,
+    "DS": 43,
+    "CAA": 257,
+}
+
+CLASS_IN = 1
+FLAG_RD = 0x0100
+FLAG_TC = 0x0200
+
+
+class DNSError(Exception): ...
+
+
+def encode_name(name):
+    encoded = b""
+    for label in name.strip(".").split("."):
+        if not label:
+            continue
+        label = label.encode("idna")
+        if len(label) > 63:
+            raise DNSError("Label too long in {}".format(name))
+        encoded += struct.pack("!B", len(label)) + label
+    return encoded + b"\x00"
+
+
+def build_query(name, qtype, query_id=None):
+    if query_id is None:
+        query_id = random.getrandbits(16)
+    header = struct.pack("!HHHHHH", query_id, FLAG_RD, 1, 0, 0, 0)
+    return query_id, header + encode_name(name) + struct.pack("!HH", QTYPES[qtype], CLASS_IN)
+
+
+def read_name(data, offset):
+    labels = []
+    end = None
+    for _ in range(128):  # Guards against compression loops
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack_from("!H", data, offset)[0] & 0x3FFF
+            continue
+        offset += 1
+        if length == 0:
+            return ".".join(labels), offset if end is None else end
+        labels.append(data[offset : offset + length].decode("ascii", "replace"))
+        offset += length
+
+    raise DNSError("Malformed name")
+
+
+def format_rdata(data, rtype, offset, length):
+    rdata = data[offset : offset + length]
+    if rtype == QTYPES["A"]:
+        return socket.inet_ntop(socket.AF_INET, rdata)
+    if rtype == QTYPES["AAAA"]:
+        return socket.inet_ntop(socket.AF_INET6, rdata)
+    if rtype in (QTYPES["NS"], QTYPES["CNAME"], QTYPES["PTR"]):
+        return read_name(data, offset)[0]
+    if rtype == QTYPES["MX"]:
+        return read_name(data, offset + 2)[0]
+    if rtype == QTYPES["SRV"]:
+        weight, port = struct.unpack_from("!HH", data, offset + 2)
+        return "{} {} {}".format(weight, port, read_name(data, offset + 6)[0])
+    if rtype == QTYPES["TXT"]:
+        chunks, position = [], 0
+        while position < len(rdata):
+            chunk_length = rdata[position]
+            chunks.append(rdata[position + 1 : position + 1 + chunk_length].decode("utf-8"))
+            position += 1 + chunk_length
+        return "".join(chunks)
+    if rtype == QTYPES["CAA"]:
+        flags, tag_length = struct.unpack_from("!BB", rdata)
+        tag = rdata[2 : 2 + tag_length].decode("ascii")
+        return '{} {} "{}"'.format(flags, tag, rdata[2 + tag_length :].decode("utf-8"))
+    if rtype == QTYPES["DS"]:
+        key_tag, algorithm, digest_type = struct.unpack_from("!HBB", rdata)
+        return "{} {} {} {}".format(key_tag, algorithm, digest_type, rdata[4:].hex().upper())
+    return rdata.hex()
+
+
+def parse_response(data, query_id, qtype):
+    """Returns the values of the answers of type ``qtype`` or ``None`` for a foreign message."""
+    if len(data) < 12:
+        return None
+    response_id, flags, qdcount, ancount = struct.unpack_from("!HHHH", data)
+    if response_id != query_id:
+        return None
+    if flags & FLAG_TC:
+        # Truncated answers can't be compared reliably; treat them as not yet visible
+        return []
+
+    offset = 12
+    for _ in range(qdcount):
+        offset = read_name(data, offset)[1] + 4
+
+    values = []
+    for _ in range(ancount):
+        offset = read_name(data, offset)[1]
+        rtype, _, _, length = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        if rtype == QTYPES[qtype]:
+            values.append(format_rdata(data, rtype, offset, length))
+        offset += length
+
+    return values
+
+
+def normalize_value(rtype, value):
+    value = value.strip()
+    if rtype in ("A", "AAAA"):
+        try:
+            return str(ipaddress.ip_address(value))
+        except ValueError:
+            return value
+    if rtype == "TXT":
+        # Served as the concatenation of its character strings
+        return b"".join(txt_chunks(value)).decode("utf-8")
+    value = re.sub(r"\s+", " ", value)
+    if rtype == "DS":
+        return value.upper()
+    if rtype == "CAA":
+        return value
+    return value.rstrip(".").lower()
+
+
+def parse_server(server):
+    """Resolves ``host``, ``host:port`` or ``[ipv6]:port`` to a socket address."""
+    host, port = server, 53
+    match = re.match(r"^\[(?P<host>[^\]]+)\](?::(?P<port>\d+))?$", server)
+    if match:
+        host, port = match.group("host"), int(match.group("port") or 53)
+    elif server.count(":") == 1:
+        host, port = server.split(":")
+        port = int(port)
+
+    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    return family, address
+
+
+def query_many(servers, name, qtype, timeout):
+    """Sends the same query to every server concurrently.
+
+    Returns a dict mapping each server which answered within ``timeout`` seconds to the values it
+    returned. Servers that can't be resolved or reached are treated as not answering.
+    """
+    sockets = {}
+    answers = {}
+    try:
+        for server in servers:
+            try:
+                family, address = parse_server(server)
+                sock = socket.socket(family, socket.SOCK_DGRAM)
+            except (OSError, ValueError):
+                continue
+            try:
+                sock.setblocking(False)
+                query_id, query = build_query(name, qtype)
+                sock.sendto(query, address)
+            except OSError:
+                sock.close()
+                continue
+            sockets[sock] = (server, query_id)
+
+        deadline = time.monotonic() + timeout
+        while sockets:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable, _, _ = select.select(list(sockets), [], [], remaining)
+            for sock in readable:
+                server, query_id = sockets[sock]
+                try:
+                    data = sock.recv(65535)
+                    values = parse_response(data, query_id, qtype)
+                except (OSError, DNSError, struct.error, IndexError, UnicodeDecodeError):
+                    values = None
+                if values is not None:
+                    answers[server] = values
+                    del sockets[sock]
+                    sock.close()
+    finally:
+        for sock in sockets:
+            sock.close()
+
+    return answers
+
+
+def system_resolvers(path="/etc/resolv.conf"):
+    try:
+        with open(path, "r") as stream:
+            return [
+                line.split()[1]
+                for line in stream
+                if line.startswith("nameserver") and len(line.split()) > 1
+            ]
+    except OSError:
+        return []
+
+
+def find_nameservers(domain, resolvers=None, timeout=5):
+    """Returns the addresses of the authoritative nameservers of ``domain``."""
+    resolvers = resolvers or system_resolvers()
+    names = set()
+    for values in query_many(resolvers, domain, "NS", timeout).values():
+        names.update(values)
+
+    addresses = set()
+    for name in names:
+        try:
+            for _, _, _, _, address in socket.getaddrinfo(name, 53, type=socket.SOCK_DGRAM):
+                host = address[0]
+                addresses.add("[{}]".format(host) if ":" in host else host)
+        except OSError:
+            continue
+
+    return sorted(addresses)
+
+
+def wait_for_values(
+    servers,
+    name,
+    qtype,
+    expected,
+    timeout,
+    *,
+    initial_delay=0.5,
+    max_delay=10.0,
+):
+    """Polls ``servers`` concurrently until all of them serve every value of ``expected``.
+
+    The delay between two polls doubles every round, up to ``max_delay``, so that fast
+    propagations are detected quickly while slow ones don't flood the nameservers. Returns the
+    servers that still don't serve the expected values once ``timeout`` seconds have elapsed;
+    an empty list means the record propagated.
+    """
+    expected = {normalize_value(qtype, value) for value in expected}
+    pending = list(servers)
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        round_start = time.monotonic()
+        answers = query_many(pending, name, qtype, min(delay, remaining))
+        pending = [
+            server
+            for server in pending
+            if not expected <= {normalize_value(qtype, it) for it in answers.get(server, [])}
+        ]
+        if not pending:
+            break
+        time.sleep(
+            max(0, min(delay - (time.monotonic() - round_start), deadline - time.monotonic()))
+        )
+        delay = min(delay * 2, max_delay)
+
+    return pending
@@ -0,0 +1,194 @@
+"""Local SQLite mirror of the domains and DNS records of an account.
+
+The mirror is refreshed every time the account is listed and updated write-through when records
+are created, updated or deleted, so questions like "which records point at this IP?" can be
+answered with indexed queries instead of scanning the whole ``/record/`` listing.
+"""
+
+import json
+import sqlite3
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS domains (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    href TEXT NOT NULL UNIQUE,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY,
+    domain_href TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value TEXT NOT NULL,
+    priority INTEGER,
+    ttl INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS records_domain ON records (domain_href);
+CREATE INDEX IF NOT EXISTS records_name ON records (name);
+CREATE INDEX IF NOT EXISTS records_type ON records (type);
+CREATE INDEX IF NOT EXISTS records_value ON records (value);
+CREATE INDEX IF NOT EXISTS records_domain_name_type ON records (domain_href, name, type);
+CREATE INDEX IF NOT EXISTS domains_name ON domains (name);
+"""
+
+
+class RecordMirror(object):
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~ Maintenance ~~~~~~~~~~~~~~~~~~~~~~~ #
+
+    def _set_meta(self, key, value):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def sync_domains(self, domains):
+        """Replaces the mirrored domains with a full listing."""
+        with self.connection:
+            self.connection.execute("DELETE FROM domains")
+            self.connection.executemany(
+                "INSERT INTO domains (id, name, href, data) VALUES (?, ?, ?, ?)",
+                [(it["id"], it["name"], it["href"], json.dumps(it)) for it in domains],
+            )
+            self._set_meta("domains_synced_at", str(time.time()))
+
+    def sync_records(self, records):
+        """Replaces the mirrored records with a full listing."""
+        with self.connection:
+            self.connection.execute("DELETE FROM records")
+            self.connection.executemany(
+                "INSERT INTO records (id, domain_href, name, type, value, priority, ttl, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [self._record_row(it) for it in records],
+            )
+            self._set_meta("records_synced_at", str(time.time()))
+
+    @staticmethod
+    def _record_row(record):
+        return (
+            record["id"],
+            record["domain"]["href"],
+            record.get("name") or "",
+            record["type"],
+            record.get("value") or "",
+            record.get("priority"),
+            record.get("ttl"),
+            json.dumps(record),
+        )
+
+    def upsert_record(self, record_id, **data):
+        """Writes the fields of ``data`` over the mirrored record ``record_id``.
+
+        ``data`` is in the format sent to the API, where ``domain`` is the domain's id.
+        """
+        row = self.connection.execute("SELECT data FROM records WHERE id = ?", (record_id,))
+        row = row.fetchone()
+        record = json.loads(row["data"]) if row else {"id": record_id}
+
+        domain = data.pop("domain", None)
+        if domain is not None:
+            href = self.connection.execute("SELECT href FROM domains WHERE id = ?", (domain,))
+            href = href.fetchone()
+            if href is None:
+                # Unknown domain: the mirror can't be trusted anymore
+                return self.invalidate_records()
+            record["domain"] = {"href": href["href"]}
+
+        record.update(data)
+        if "domain" not in record or "type" not in record or "value" not in record:
+            return self.invalidate_records()
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO records "
+                "(id, domain_href, name, type, value, priority, ttl, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._record_row(record),
+            )
+
+    def delete_record(self, record_id):
+        with self.connection:
+            self.connection.execute("DELETE FROM records WHERE id = ?", (record_id,))
+
+    def invalidate_records(self):
+        """Marks the records as stale until the next full listing."""
+        with self.connection:
+            self._set_meta("records_synced_at", None)
+
+    def is_fresh(self):
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'records_synced_at'"
+        ).fetchone()
+        return row is not None and row["value"] is not None
+
+    # ~~~~~~~~~~~~~~~~~~~~~~~ Queries ~~~~~~~~~~~~~~~~~~~~~~~ #
+
+    def query(self, domain=None, name=None, type=None, value=None):
+        """Returns the records matching every given criterion, with their domain name."""
+        clauses, args = [], []
+        for column, criterion in (
+            ("domains.name", domain),
+            ("records.name", name),
+            ("records.type", type),
+            ("records.value", value),
+        ):
+            if criterion is not None:
+                clauses.append("{} = ?".format(column))
+                args.append(criterion)
+
+        sql = (
+            "SELECT records.data, domains.name AS domain_name FROM records "
+            "JOIN domains ON domains.href = records.domain_href"
+        )
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY domains.name, records.name, records.type, records.id"
+
+        return [
+            {**json.loads(row["data"]), "domain_name": row["domain_name"]}
+            for row in self.connection.execute(sql, args)
+        ]
+
+    def names_with_types(self, types, domain=None):
+        """Returns the ``(domain, name)`` pairs having a record of each of ``types``.
+
+        For instance ``names_with_types(["A", "CNAME"])`` finds CNAME conflicts.
+        """
+        types = sorted(set(types))
+        sql = (
+            "SELECT domains.name AS domain_name, records.name AS name FROM records "
+            "JOIN domains ON domains.href = records.domain_href "
+            "WHERE records.type IN ({})".format(", ".join("?" * len(types)))
+        )
+        args = list(types)
+        if domain is not None:
+            sql += " AND domains.name = ?"
+            args.append(domain)
+        sql += (
+            " GROUP BY domains.name, records.name HAVING COUNT(DISTINCT records.type) = ?"
+            " ORDER BY domains.name, records.name"
+        )
+        args.append(len(types))
+
+        return [(row["domain_name"], row["name"]) for row in self.connection.execute(sql, args)]
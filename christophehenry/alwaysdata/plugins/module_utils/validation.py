@@ -0,0 +1,195 @@
+"""Validation of DNS records before any request is sent to the API.
+
+Every check is local, so invalid tasks fail without listing the account or waiting for the API to
+reject a write. ``validate_record`` returns the list of problems of one record, an empty list
+meaning the record is valid; ``validate_records`` checks a whole batch in one pass.
+"""
+
+import ipaddress
+import re
+
+TTL_MIN = 0
+TTL_MAX = 2**31 - 1  # RFC 2181, section 8
+TXT_CHUNK_LENGTH = 255
+TXT_MAX_LENGTH = 65535 - 255  # Leaves room for the length octet of every chunk
+
+NAME_RE = re.compile(r"[\w\-.]+")
+LABEL_RE = re.compile(r"^[A-Za-z0-9_]([A-Za-z0-9_-]{0,61}[A-Za-z0-9_])?$")
+CAA_RE = re.compile(r'^(?P<flags>\d{1,3})\s+(?P<tag>[A-Za-z0-9]+)\s+(?P<value>"[^"]*"|\S+)$')
+DS_RE = re.compile(
+    r"^(?P<key_tag>\d+)\s+(?P<algorithm>\d+)\s+(?P<digest_type>\d+)\s+(?P<digest>.+)$"
+)
+TXT_QUOTED_RE = re.compile(r'^("[^"]*"\s*)+$')
+
+DS_DIGEST_LENGTHS = {1: 40, 2: 64, 4: 96}
+
+
+def is_hostname(value):
+    value = value[:-1] if value.endswith(".") else value
+    if not value or len(value) > 253:
+        return False
+    return all(LABEL_RE.match(label) for label in value.split("."))
+
+
+def txt_chunks(value):
+    """Splits a TXT value into the character strings sent over DNS.
+
+    Values made of quoted strings, like ``"v=DKIM1; k=rsa; " "p=MIGf..."``, are kept as they are
+    split; other values are cut every 255 bytes.
+    """
+    if TXT_QUOTED_RE.match(value):
+        return [chunk.encode("utf-8") for chunk in re.findall(r'"([^"]*)"', value)]
+    encoded = value.encode("utf-8")
+    return [
+        encoded[index : index + TXT_CHUNK_LENGTH]
+        for index in range(0, len(encoded), TXT_CHUNK_LENGTH)
+    ] or [b""]
+
+
+def validate_ip(version):
+    def validate(value):
+        try:
+            address = ipaddress.ip_address(value)
+        except ValueError:
+            return ["'{}' is not a valid IPv{} address.".format(value, version)]
+        if address.version != version:
+            return ["'{}' is not a valid IPv{} address.".format(value, version)]
+        return []
+
+    return validate
+
+
+def validate_hostname(value):
+    if not is_hostname(value):
+        return ["'{}' is not a valid host name.".format(value)]
+    return []
+
+
+def validate_caa(value):
+    match = CAA_RE.match(value)
+    if not match:
+        return ["'{}' is not a valid CAA value; expected 'flags tag \"value\"'.".format(value)]
+    if int(match.group("flags")) > 255:
+        return ["CAA flags must be between 0 and 255."]
+    return []
+
+
+def validate_srv(value):
+    parts = value.split()
+    if len(parts) != 3 or not all(it.isdigit() for it in parts[:2]):
+        return ["'{}' is not a valid SRV value; expected 'weight port target'.".format(value)]
+    errors = []
+    if int(parts[0]) > 65535 or int(parts[1]) > 65535:
+        errors.append("SRV weight and port must be between 0 and 65535.")
+    if parts[2] != "." and not is_hostname(parts[2]):
+        errors.append("'{}' is not a valid SRV target.".format(parts[2]))
+    return errors
+
+
+def validate_ds(value):
+    match = DS_RE.match(value)
+    if not match:
+        return [
+            "'{}' is not a valid DS value; expected 'key_tag algorithm digest_type digest'.".format(
+                value
+            )
+        ]
+    errors = []
+    if int(match.group("key_tag")) > 65535:
+        errors.append("DS key tag must be between 0 and 65535.")
+    if int(match.group("algorithm")) > 255:
+        errors.append("DS algorithm must be between 0 and 255.")
+    digest = re.sub(r"\s+", "", match.group("digest"))
+    if not re.match(r"^[0-9A-Fa-f]+$", digest):
+        errors.append("DS digest must be hexadecimal.")
+    expected_length = DS_DIGEST_LENGTHS.get(int(match.group("digest_type")))
+    if expected_length and len(digest) != expected_length:
+        errors.append(
+            "DS digest of type {} must be {} hexadecimal characters long.".format(
+                match.group("digest_type"), expected_length
+            )
+        )
+    return errors
+
+
+def validate_txt(value):
+    chunks = txt_chunks(value)
+    if any(len(chunk) > TXT_CHUNK_LENGTH for chunk in chunks):
+        return ["TXT quoted strings must be at most {} bytes long.".format(TXT_CHUNK_LENGTH)]
+    if sum(len(chunk) for chunk in chunks) > TXT_MAX_LENGTH:
+        return ["TXT value must be at most {} bytes long.".format(TXT_MAX_LENGTH)]
+    return []
+
+
+VALUE_VALIDATORS = {
+    "A": validate_ip(4),
+    "AAAA": validate_ip(6),
+    "ALIAS": validate_hostname,
+    "CAA": validate_caa,
+    "CNAME": validate_hostname,
+    "DS": validate_ds,
+    "MX": validate_hostname,
+    "NS": validate_hostname,
+    "PTR": validate_hostname,
+    "SRV": validate_srv,
+    "TXT": validate_txt,
+}
+
+
+def validate_record(params):
+    """Returns the problems of a record described by the module's parameters.
+
+    Missing or malformed arguments are reported first; the value is only checked once they are
+    fixed, so that the first message is the most relevant one.
+    """
+    errors = []
+    rtype = params.get("type")
+
+    if params.get("name") and not NAME_RE.fullmatch(params["name"]):
+        errors.append(
+            "'name' argument must be composed of ASCII letters (a-z), "
+            "numbers (0-9) dashes, underscores and dots."
+        )
+
+    if params.get("priority") is None and rtype in ("MX", "SRV"):
+        errors.append("'priority' argument is required for 'MX', 'SRV' records.")
+
+    if params.get("regex"):
+        try:
+            re.compile(params["regex"])
+        except re.error as e:
+            errors.append("'regex' argument is not a valid regular expression: {}.".format(e))
+
+    if errors:
+        return errors
+
+    if params.get("name"):
+        labels = params["name"].split(".")
+        if any(not label or len(label) > 63 for label in labels):
+            errors.append("'name' labels must be between 1 and 63 characters long.")
+        if params.get("domain") and len(params["name"]) + 1 + len(params["domain"]) > 253:
+            errors.append("'name' is too long: the full host name exceeds 253 characters.")
+
+    if params.get("priority") is not None and not 0 <= params["priority"] <= 65535:
+        errors.append("'priority' argument must be between 0 and 65535.")
+
+    if params.get("ttl") is not None and not TTL_MIN <= params["ttl"] <= TTL_MAX:
+        errors.append("'ttl' argument must be between {} and {}.".format(TTL_MIN, TTL_MAX))
+
+    if params.get("value") is not None and rtype in VALUE_VALIDATORS:
+        errors.extend(VALUE_VALIDATORS[rtype](params["value"]))
+
+    return errors
+
+
+def validate_records(records):
+    """Validates a batch of records in one pass.
+
+    Returns a dict mapping the index of every invalid record to its problems.
+    """
+    errors = {}
+    for index, params in enumerate(records):
+        record_errors = validate_record(params)
+        if record_errors:
+            errors[index] = record_errors
+    return errors
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+
+from __future__ import absolute_import, division, print_function
+
+import json
+
+from ansible.module_utils.basic import AnsibleModule
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.alwaysdata import (
+    api_argument_spec,
+    dump_json,
+    list_domains,
+    list_records,
+    record_hashes,
+    with_metrics,
+)
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+---
+module: dnsdrift
+short_description: Detect DNS records drift since the last converged run
+description: |
+    Lists the domains and DNS records of the account once and compares a hash of each domain with
+    the hashes stored in 'baseline'. Only the names of the domains which hash changed are compared
+    and only the records of the names which hash changed are reported.
+version_added: "0.0.1"
+author:
+    - Christophe Henry (@christophehenry)
+extends_documentation_fragment:
+    - christophehenry.alwaysdata.api
+
+options:
+    token:
+        description: The API token to use as defined in https://admin.alwaysdata.com/token/
+        required: true
+        type: str
+    baseline:
+        description: |
+            Path to the hashes stored by the last converged run. A missing file is considered
+            empty, so every domain is reported as drifted.
+        required: true
+        type: path
+    domains:
+        description: Only check these domains. All domains of the account are checked by default.
+        required: false
+        type: list
+        elements: str
+    update_baseline:
+        description: Write the current hashes to 'baseline' once compared.
+        required: false
+        type: bool
+        default: false
+
+attributes:
+    check_mode:
+        support: full
+    diff_mode:
+        support: none
+"""
+
+EXAMPLES = r"""
+- name: Checking DNS drift
+  christophehenry.alwaysdata.dnsdrift:
+    token: "6^6c*evw95f@2q6s%moh49+gaerd06^&a!*#y&=z8g3vt+=pew"
+    baseline: /var/lib/alwaysdata/baseline.json
+  register: drift
+
+- name: Storing hashes after a converged run
+  christophehenry.alwaysdata.dnsdrift:
+    token: "6^6c*evw95f@2q6s%moh49+gaerd06^&a!*#y&=z8g3vt+=pew"
+    baseline: /var/lib/alwaysdata/baseline.json
+    update_baseline: true
+"""
+
+RETURN = r"""
+drifted:
+    description: Names of the domains which records changed since the baseline
+    type: list
+    elements: str
+drift:
+    description: |
+        For each drifted domain, the records of each changed name as stored in the baseline
+        ('before') and as currently served ('after').
+    type: dict
+    sample:
+        example.com:
+            git:
+                before:
+                - {type: A, name: git, value: "128.45.87.69", priority: null, ttl: 300}
+                after:
+                - {type: A, name: git, value: "128.45.87.70", priority: null, ttl: 300}
+"""
+
+
+BASELINE_VERSION = 1
+
+
+MODULE_ARGS = dict(
+    token=dict(type="str", required=True, no_log=True),
+    baseline=dict(type="path", required=True),
+    domains=dict(type="list", elements="str"),
+    update_baseline=dict(type="bool", default=False),
+    **api_argument_spec(),
+)
+
+
+def load_baseline(module, path):
+    try:
+        with open(path, "r") as stream:
+            baseline = json.load(stream)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        return module.fail_json(msg="Unable to read baseline {}: {}".format(path, e))
+
+    if (
+        not isinstance(baseline, dict)
+        or baseline.get("version") != BASELINE_VERSION
+        or not isinstance(baseline.get("domains"), dict)
+    ):
+        return module.fail_json(
+            msg="Unsupported baseline format in {}; expected version {}".format(
+                path, BASELINE_VERSION
+            )
+        )
+
+    return baseline["domains"]
+
+
+def compare_hashes(baseline, current):
+    """Returns the record diff of every name which hash changed, grouped by domain.
+
+    Names are only compared for the domains which hash changed.
+    """
+    drift = {}
+    for domain_name in sorted(set(baseline) | set(current)):
+        before = baseline.get(domain_name, {"hash": None, "names": {}})
+        after = current.get(domain_name, {"hash": None, "names": {}})
+        if before["hash"] == after["hash"]:
+            continue
+
+        names = {}
+        for name in sorted(set(before["names"]) | set(after["names"])):
+            before_name = before["names"].get(name, {"hash": None, "records": []})
+            after_name = after["names"].get(name, {"hash": None, "records": []})
+            if before_name["hash"] != after_name["hash"]:
+                names[name] = {
+                    "before": before_name["records"],
+                    "after": after_name["records"],
+                }
+
+        drift[domain_name] = names
+
+    return drift
+
+
+def dnsdrift():
+    module = AnsibleModule(argument_spec=MODULE_ARGS, supports_check_mode=True)
+
+    token = module.params["token"]
+    path = module.params["baseline"]
+
+    stored = load_baseline(module, path)
+    baseline = stored
+    domains = list_domains(module, token)
+    if module.params.get("domains") is not None:
+        domains = [it for it in domains if it["name"] in module.params["domains"]]
+        baseline = {
+            name: hashes for name, hashes in stored.items() if name in module.params["domains"]
+        }
+
+    current = record_hashes(domains, list_records(module, token))
+    drift = compare_hashes(baseline, current)
+
+    result = {
+        "changed": False,
+        "drifted": list(drift),
+        "drift": drift,
+    }
+
+    if module.params["update_baseline"] and drift:
+        result["changed"] = True
+        if module.params.get("domains") is not None:
+            # Keep the hashes of the domains that were not checked
+            current = {
+                **{name: hashes for name, hashes in stored.items() if name not in baseline},
+                **current,
+            }
+        if not module.check_mode:
+            dump_json(path, {"version": BASELINE_VERSION, "domains": current})
+
+    return module.exit_json(**with_metrics(module, result))
+
+
+def main():
+    dnsdrift()
+
+
+if __name__ == "__main__":
+    main()
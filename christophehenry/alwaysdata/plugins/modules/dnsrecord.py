@@ -3,12 +3,30 @@
 from __future__ import absolute_import, division, print_function
 
 import re
+import time
 
 from ansible.module_utils.basic import AnsibleModule
 
 from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.alwaysdata import (
+    api_argument_spec,
     api_query,
+    budget,
+    deadline_exceeded,
+    fail_deadline,
     list_domains,
+    list_records,
+    load_snapshot,
+    task_state,
+    update_mirror,
+    with_metrics,
+)
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.dns import (
+    QTYPES,
+    find_nameservers,
+    wait_for_values,
+)
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.validation import (
+    validate_records,
 )
 
 # from .domain import list_domains
@@ -23,6 +41,8 @@ short_description: Add to or delete DSN records from a domain
 version_added: "0.0.1"
 author:
     - Christophe Henry (@christophehenry)
+extends_documentation_fragment:
+    - christophehenry.alwaysdata.api
 
 options:
     domain:
@@ -30,9 +50,20 @@ options:
         required: true
         type: str
     token:
-        description: The API token to use as defined in https://admin.alwaysdata.com/token/
-        required: true
+        description: |
+            The API token to use as defined in https://admin.alwaysdata.com/token/
+
+            Required unless 'snapshot' is provided.
+        required: false
         type: str
+    snapshot:
+        description: |
+            Path to an account snapshot written by the 'christophehenry.alwaysdata.snapshot'
+            module. When set, domains and records are read from this file instead of the API,
+            check mode is implied and no network call is made. The operations that would be sent
+            to the API are returned in 'plan'.
+        required: false
+        type: path
     type:
         description: The type of DNS record
         required: if 'state' is 'present'
@@ -59,7 +90,8 @@ options:
             Whether the record should be present or absent.
 
             When this value is 'absent', and one or several records with the same 'name', 'type'
-            and 'value' exists, it will be removed. If 'regex' if specified, it will be used to
+            and 'value' exists, it will be removed. With 'values', only the records having one of
+            these values are removed. If 'regex' if specified, it will be used to
             check against records instead of 'value". So any record which 'value' field matches the
             specified 'regex' will be removed.
 
@@ -67,15 +99,36 @@ options:
             updated with provided values. Existing records will be detected of they have the same
             'name', 'type' and 'value' or if 'existing records' 'values' matches 'regex' when
             procided.
+
+            With 'values', the existing records are reconciled with the whole record set using as
+            few API calls as possible: records already up to date are left untouched, outdated
+            records are updated in place, missing records are created and records whose value is
+            not listed are deleted. Creations are sent first and deletions last. With 'value',
+            a single record is updated, preferably one already holding that value, and the other
+            records of the set are left untouched.
         required: false
         choices:
         - present
         - absent
         default: present
     value:
-        description: The value for this DNS record. For instance the IP for A and AAAA records.
-        required: if state is 'present'
+        description: |
+            The value for this DNS record. For instance the IP for A and AAAA records.
+
+            The value is checked against the syntax of its type before any call to the API: IP
+            addresses for A and AAAA records, host names for ALIAS, CNAME, MX, NS and PTR records,
+            'weight port target' for SRV records, 'flags tag "value"' for CAA records and
+            'key_tag algorithm digest_type digest' for DS records.
+        required: if state is 'present' and 'values' is not provided
         type: str
+    values:
+        description: |
+            The values of a record set, for instance the IPs of a round-robin A record. Unlike
+            'value', the existing records with the same 'name' and 'type' but another value are
+            deleted. Mutually exclusive with 'value'. Each value is checked like 'value'.
+        required: false
+        type: list
+        elements: str
     regex:
         description: |
             A regex to use to detect if record is present. If set, this regex will be used against
@@ -88,13 +141,42 @@ options:
         required: false
         type: int
     ttl:
-        description: TTL value.
+        description: TTL value, between 0 and 2147483647.
         required: false
         type: int
     annotation:
         description: Appears in records listing.
         required: false
         type: str
+    wait_for_propagation:
+        description: |
+            When the record is created or updated, wait until the authoritative nameservers of the
+            domain, and the 'propagation_resolvers', serve the new value. All servers are polled
+            concurrently, with a delay doubling between polls, and the task returns as soon as
+            the value is visible everywhere.
+        required: false
+        type: bool
+        default: false
+    propagation_timeout:
+        description: |
+            Number of seconds to wait for propagation before failing. The wait is also bounded by
+            the time left to the 'task_timeout'.
+        required: false
+        type: int
+        default: 300
+    propagation_nameservers:
+        description: |
+            Nameservers to poll instead of the authoritative nameservers of the domain, as 'host',
+            'host:port' or '[ipv6]:port'.
+        required: false
+        type: list
+        elements: str
+    propagation_resolvers:
+        description: Additional resolvers to poll, in the same format as 'propagation_nameservers'.
+        required: false
+        type: list
+        elements: str
+        default: []
 
 attributes:
     check_mode:
@@ -114,6 +196,39 @@ EXAMPLES = r"""
     name: git
     value: "128.45.87.69"
 
+# Planning a change offline from a saved account snapshot
+- name: Planning 'git' subdomain update
+  christophehenry.alwaysdata.dnsrecord:
+    domain: example.com
+    snapshot: /tmp/alwaysdata-snapshot.json
+    state: present
+    type: A
+    name: git
+    value: "128.45.87.69"
+
+# Creating a record and waiting for it to be served before requesting a certificate
+- name: Creating 'git' subdomain
+  christophehenry.alwaysdata.dnsrecord:
+    domain: example.com
+    token: "6^6c*evw95f@2q6s%moh49+gaerd06^&a!*#y&=z8g3vt+=pew"
+    type: A
+    name: git
+    value: "128.45.87.69"
+    wait_for_propagation: true
+    propagation_resolvers:
+    - 1.1.1.1
+
+# Reconciling a round-robin record set
+- name: Setting 'www' subdomain addresses
+  christophehenry.alwaysdata.dnsrecord:
+    domain: example.com
+    token: "6^6c*evw95f@2q6s%moh49+gaerd06^&a!*#y&=z8g3vt+=pew"
+    type: A
+    name: www
+    values:
+    - "128.45.87.69"
+    - "128.45.87.70"
+
 # Removing a record
 - name: Removing all 'git' subdomain
   christophehenry.alwaysdata.dnsrecord:
@@ -146,6 +261,40 @@ type:
 name:
     description: Host name used
     type: str
+plan:
+    description: |
+        The API calls that would be made to reach the desired state. Only returned when
+        'snapshot' is provided.
+    returned: when snapshot is provided
+    type: list
+    elements: dict
+    sample:
+    - method: PUT
+      route: record/12345
+      data:
+        domain: 67890
+        type: A
+        name: git
+        value: "128.45.87.69"
+completed:
+    description: |
+        The writes that were applied before the task failed, for instance because its
+        'task_timeout' was exceeded.
+    returned: on failure, when some records were already written
+    type: list
+    elements: dict
+    sample:
+    - method: POST
+      route: record
+propagation:
+    description: The servers that were polled and the time it took for the record to be served.
+    returned: when wait_for_propagation is true and the record changed
+    type: dict
+    sample:
+        servers:
+        - 185.31.40.11
+        - 185.31.41.11
+        elapsed: 2.54
 """
 
 
@@ -154,7 +303,8 @@ __route__ = "record"
 
 MODULE_ARGS = dict(
     domain=dict(type="str", required=True),
-    token=dict(type="str", required=True, no_log=True),
+    token=dict(type="str", no_log=True),
+    snapshot=dict(type="path"),
     type=dict(
         type="str",
         choices=[
@@ -175,10 +325,16 @@ MODULE_ARGS = dict(
     name=dict(type="str"),
     state=dict(type="str", default="present", choices=["absent", "present"]),
     value=dict(type="str"),
+    values=dict(type="list", elements="str"),
     regex=dict(type="str"),
     priority=dict(type="int"),
     ttl=dict(type="int"),
     annotation=dict(type="str"),
+    wait_for_propagation=dict(type="bool", default=False),
+    propagation_timeout=dict(type="int", default=300),
+    propagation_nameservers=dict(type="list", elements="str"),
+    propagation_resolvers=dict(type="list", elements="str", default=[]),
+    **api_argument_spec(),
 )
 
 
@@ -224,11 +380,11 @@ class ApiParams(object):
 
 
 def list_dnsrecord(module, token):
-    return api_query(module, token, __route__)
+    return list_records(module, token)
 
 
 def delete_dnsrecord(module, token, record_id):
-    return api_query(
+    response = api_query(
         module,
         token,
         "{}/{}".format(__route__, record_id),
@@ -236,10 +392,12 @@ def delete_dnsrecord(module, token, record_id):
         fail_msg="Resource was not deleted",
         method="DELETE",
     )
+    update_mirror(module, "delete_record", record_id)
+    return response
 
 
 def create_dnsrecord(module, token, **data):
-    return api_query(
+    response = api_query(
         module,
         token,
         __route__,
@@ -248,58 +406,217 @@ def create_dnsrecord(module, token, **data):
         method="POST",
         data=data,
     )
+    if isinstance(response, dict) and response.get("id") is not None:
+        update_mirror(
+            module,
+            "upsert_record",
+            response["id"],
+            **{**data, **response, "domain": data["domain"]},
+        )
+    else:
+        # The API doesn't return the new record: it will be mirrored by the next listing
+        update_mirror(module, "invalidate_records")
+    return response
 
 
 def update_dnsrecord(module, token, record_id, /, **data):
-    return api_query(module, token, "{}/{}".format(__route__, record_id), method="PUT", data=data)
+    response = api_query(
+        module, token, "{}/{}".format(__route__, record_id), method="PUT", data=data
+    )
+    update_mirror(module, "upsert_record", record_id, **data)
+    return response
+
+
+def filter_record(module, domain, record):
+    prereq = record["domain"]["href"] == domain.href and record["name"] == module.params["name"]
+
+    if module.params.get("type"):
+        prereq = prereq and record["type"] == module.params["type"]
+
+    if module.params.get("regex"):
+        return prereq and re.compile(module.params["regex"]).match(record["value"])
+
+    if module.params["state"] == "absent" and module.params.get("value") is not None:
+        prereq = prereq and record["value"] == module.params["value"]
+
+    if module.params["state"] == "absent" and module.params.get("values"):
+        prereq = prereq and record["value"] in module.params["values"]
+
+    return prereq
+
+
+def plan_operation(method, record_id=None, data=None):
+    route = __route__ if record_id is None else "{}/{}".format(__route__, record_id)
+    operation = {"method": method, "route": route}
+    if data is not None:
+        operation["data"] = data
+    return operation
+
+
+def wait_for_propagation(module, domain):
+    name = module.params.get("name")
+    fqdn = "{}.{}".format(name, domain.name) if name else domain.name
+
+    if deadline_exceeded(module):
+        return fail_deadline(module, "before waiting for the propagation of {}".format(fqdn))
+
+    started = time.monotonic()
+    servers = module.params.get("propagation_nameservers") or find_nameservers(domain.name)
+    if not servers:
+        return module.fail_json(
+            msg="Unable to find the nameservers of {}".format(domain.name),
+            completed=task_state(module)["completed"],
+        )
+    servers = [*servers, *module.params["propagation_resolvers"]]
+
+    pending = wait_for_values(
+        servers,
+        fqdn,
+        module.params["type"],
+        module.params.get("values") or [module.params["value"]],
+        budget(module, module.params["propagation_timeout"]) - (time.monotonic() - started),
+    )
+    if pending:
+        if deadline_exceeded(module):
+            return fail_deadline(module, "while waiting for the propagation of {}".format(fqdn))
+        return module.fail_json(
+            msg="Record was not propagated after {}s".format(module.params["propagation_timeout"]),
+            pending=pending,
+            completed=task_state(module)["completed"],
+        )
+
+    return {"servers": servers, "elapsed": round(time.monotonic() - started, 2)}
+
+
+def plan_record_set(existing, desired):
+    """Computes the smallest set of API calls turning ``existing`` records into ``desired`` ones.
+
+    ``existing`` are API records and ``desired`` are API parameters, all of the same domain, name
+    and type. Each desired record is matched to at most one existing record; a matched pair costs
+    nothing when the existing record already has the desired parameters, one PUT otherwise, while
+    an unmatched existing record costs a DELETE and an unmatched desired record a POST. The
+    matching of minimum cost is found by first keeping as many unchanged records as possible,
+    then pairing the rest, records with the same value first so that PUTs change as few fields as
+    possible.
+
+    Returns the ``(to_create, to_update, to_delete)`` lists, where ``to_update`` holds
+    ``(record, desired)`` pairs.
+    """
+    keys = sorted({key for params in desired for key in params})
+
+    def projection(params, fields):
+        return tuple(params.get(field) for field in fields)
+
+    unmatched = {}
+    for record in existing:
+        unmatched.setdefault(projection(record, keys), []).append(record)
+
+    # Unchanged records are kept
+    remaining_desired = []
+    for params in desired:
+        candidates = unmatched.get(projection(params, keys))
+        if candidates:
+            candidates.pop(0)
+        else:
+            remaining_desired.append(params)
+    remaining_existing = [record for records in unmatched.values() for record in records]
+
+    # Then records are updated in place, those already having the desired value first
+    to_update = []
+    by_value = {}
+    for record in remaining_existing:
+        by_value.setdefault(record["value"], []).append(record)
+    to_create = []
+    for params in remaining_desired:
+        candidates = by_value.get(params["value"])
+        if candidates:
+            to_update.append((candidates.pop(0), params))
+        else:
+            to_create.append(params)
+    leftover = [record for records in by_value.values() for record in records]
+    while to_create and leftover:
+        to_update.append((leftover.pop(0), to_create.pop(0)))
+
+    return to_create, to_update, leftover
 
 
 def state_present(module, token, domain, filtered_records):
     result = {"changed": False}
+    plan = []
+
+    desired = [
+        ApiParams(**{**module.params, "value": value, "domain": domain}).to_api_params()
+        for value in dict.fromkeys(module.params.get("values") or [module.params["value"]])
+    ]
+    existing = [
+        {**ApiParams(**{**record, "domain": domain}).to_api_params(), "id": record["id"]}
+        for record in filtered_records
+    ]
+    if module.params.get("values"):
+        to_create, to_update, to_delete = plan_record_set(existing, desired)
+    else:
+        # A single value updates one record, without managing the rest of the set: a record
+        # which already matches, else one with the same value, else the first one
+        def differs(record):
+            return any(record.get(key) != value for key, value in desired[0].items())
+
+        target = next(
+            (record for record in existing if not differs(record)),
+            next(
+                (record for record in existing if record["value"] == desired[0]["value"]),
+                existing[0] if existing else None,
+            ),
+        )
+        to_create = [] if target else desired
+        to_update = [(target, desired[0])] if target and differs(target) else []
+        to_delete = []
 
-    params = ApiParams(**{**module.params, "domain": domain})
-    api_params = params.to_api_params()
-    if not filtered_records:
-        # No record present: we're creating
+    # Creations first and deletions last, so that names never stop resolving during the change
+    for api_params in to_create:
         if not module.check_mode:
             create_dnsrecord(module, token, **api_params)
+        plan.append(plan_operation("POST", data=api_params))
 
-        result["changed"] = True
+    for record, api_params in to_update:
+        if not module.check_mode:
+            update_dnsrecord(module, token, record["id"], **api_params)
+        plan.append(plan_operation("PUT", record["id"], api_params))
+
+    for record in to_delete:
+        if not module.check_mode:
+            delete_dnsrecord(module, token, record["id"])
+        plan.append(plan_operation("DELETE", record["id"]))
+
+    result["changed"] = bool(plan)
+    if not filtered_records and len(to_create) == 1:
+        # No record present: we're creating
         result["diff"] = {
             "before": "",
             "after": {
                 "domain": domain.name,
-                "name": api_params["name"],
-                "type": api_params["type"],
-                "value": api_params["value"],
+                "name": to_create[0]["name"],
+                "type": to_create[0]["type"],
+                "value": to_create[0]["value"],
             },
         }
+    else:
+        result["diff"] = {
+            "before": [
+                {**{k: v for k, v in record.items() if k != "id"}, "domain": domain.name}
+                for record in [*(it[0] for it in to_update), *to_delete]
+            ],
+            "after": [
+                {**api_params, "domain": domain.name}
+                for api_params in [*(it[1] for it in to_update), *to_create]
+            ],
+        }
 
-        return module.exit_json(**result)
-
-    before = []
-    after = []
-    for record in filtered_records:
-        old_params = ApiParams(**{**record, "domain": domain})
-        updated_params = {**old_params.to_api_params(), **params.to_api_params()}
-
-        if not set(old_params.to_api_params().items()) - set(updated_params.items()):
-            # Nothing to change
-            continue
-
-        result["changed"] = True
-        before.append({**old_params.to_api_params(), "domain": domain.name})
-        after.append({**params.to_api_params(), "domain": domain.name})
-
-        if not module.check_mode:
-            update_dnsrecord(module, token, record["id"], **params.to_api_params())
-
-    result["diff"] = {
-        "before": before,
-        "after": after,
-    }
+    if module.params.get("snapshot"):
+        result["plan"] = plan
+    elif result["changed"] and module.params["wait_for_propagation"] and not module.check_mode:
+        result["propagation"] = wait_for_propagation(module, domain)
 
-    return module.exit_json(**result)
+    return module.exit_json(**with_metrics(module, result))
 
 
 def state_absent(module, token, domain, filtered_records):
@@ -313,12 +630,19 @@ def state_absent(module, token, domain, filtered_records):
 
     if not filtered_records:
         result["diff"] = {"before": "", "after": ""}
-        return module.exit_json(**result)
+        if module.params.get("snapshot"):
+            result["plan"] = []
+        return module.exit_json(**with_metrics(module, result))
 
     if not module.check_mode:
         for filtered_record in filtered_records:
             delete_dnsrecord(module, token, filtered_record["id"])
 
+    if module.params.get("snapshot"):
+        result["plan"] = [
+            plan_operation("DELETE", filtered_record["id"]) for filtered_record in filtered_records
+        ]
+
     result["changed"] = True
     result["diff"] = {
         "before": [
@@ -333,34 +657,54 @@ def state_absent(module, token, domain, filtered_records):
         "after": [],
     }
 
-    return module.exit_json(**result)
+    return module.exit_json(**with_metrics(module, result))
 
 
 def dnsrecord():
     module = AnsibleModule(
         argument_spec=MODULE_ARGS,
         supports_check_mode=True,
-        required_one_of=[["value", "name", "regex"]],
-        required_if=[["state", "present", ["value", "type"]]],
+        required_one_of=[["value", "name", "regex"], ["token", "snapshot"]],
+        required_if=[
+            ["state", "present", ["value", "values"], True],
+            ["state", "present", ["type"]],
+        ],
+        mutually_exclusive=[["value", "values"]],
     )
 
     # ~~~~~~~~~~~~~~~~~~~~~~~ Args checks ~~~~~~~~~~~~~~~~~~~~~~~ #
-    if module.params.get("name") and not re.compile(r"[\w\-.]+").match(module.params["name"]):
+    # Fail before any network call
+    errors = validate_records(
+        [{**module.params, "value": value} for value in module.params.get("values") or []]
+        or [module.params]
+    )
+    if errors:
         return module.fail_json(
-            msg=(
-                "'name' argument must be composed of ASCII letters (a-z), "
-                "numbers (0-9) dashes, underscores and dots."
-            )
+            msg=" ".join(dict.fromkeys(error for it in errors.values() for error in it))
         )
 
-    if module.params.get("priority") is None and module.params["type"] in ("MX", "SRV"):
-        return module.fail_json(msg="'priority' argument is required for 'MX', 'SRV' records.")
+    if (
+        module.params["wait_for_propagation"]
+        and module.params["state"] == "present"
+        and module.params["type"] not in QTYPES
+    ):
+        return module.fail_json(
+            msg="'wait_for_propagation' is not supported for '{}' records.".format(
+                module.params["type"]
+            )
+        )
 
     token = module.params.get("token")
     state = module.params.get("state")
 
+    snapshot = None
+    if module.params.get("snapshot"):
+        # Offline plan: everything is evaluated against the snapshot, nothing is sent
+        snapshot = load_snapshot(module, module.params["snapshot"])
+        module.check_mode = True
+
     # ~~~~~~~~~~~~~~~~~~~~~~~ Checking domain ~~~~~~~~~~~~~~~~~~~~~~~ #
-    domains = list_domains(module, token)
+    domains = snapshot["domains"] if snapshot else list_domains(module, token)
     domain = [it for it in domains if it["name"] == module.params["domain"]]
 
     if not domain:
@@ -372,21 +716,8 @@ def dnsrecord():
 
     domain = Domain(**domain[0])
 
-    def filter_record(record):
-        prereq = record["domain"]["href"] == domain.href and record["name"] == module.params["name"]
-
-        if module.params.get("type"):
-            prereq = prereq and record["type"] == module.params["type"]
-
-        if module.params.get("regex"):
-            return prereq and re.compile(module.params["regex"]).match(record["value"])
-
-        if state == "absent" and module.params.get("value") is not None:
-            prereq = prereq and record["value"] == module.params["value"]
-
-        return prereq
-
-    filtered_records = list(filter(filter_record, list_dnsrecord(module, token)))
+    records = snapshot["records"] if snapshot else list_dnsrecord(module, token)
+    filtered_records = [it for it in records if filter_record(module, domain, it)]
 
     # ~~~~~~~~~~~~~~~~~~~~~~~ Execution ~~~~~~~~~~~~~~~~~~~~~~~ #
     if state == "absent":
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+from __future__ import absolute_import, division, print_function
+
+import json
+
+from ansible.module_utils.basic import AnsibleModule
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.alwaysdata import (
+    SNAPSHOT_VERSION,
+    api_argument_spec,
+    dump_snapshot,
+    list_domains,
+    list_records,
+    with_metrics,
+)
+
+__metaclass__ = type
+
+
+DOCUMENTATION = r"""
+---
+module: snapshot
+short_description: Save the domains and DNS records of an account to a file
+description: |
+    Writes the domains and DNS records of the account to a JSON file. The file can then be passed
+    to the 'snapshot' option of 'christophehenry.alwaysdata.dnsrecord' to plan changes offline.
+version_added: "0.0.1"
+author:
+    - Christophe Henry (@christophehenry)
+extends_documentation_fragment:
+    - christophehenry.alwaysdata.api
+
+options:
+    token:
+        description: The API token to use as defined in https://admin.alwaysdata.com/token/
+        required: true
+        type: str
+    dest:
+        description: Path of the snapshot file to write.
+        required: true
+        type: path
+
+attributes:
+    check_mode:
+        support: full
+    diff_mode:
+        support: none
+"""
+
+EXAMPLES = r"""
+- name: Saving the account snapshot
+  christophehenry.alwaysdata.snapshot:
+    token: "6^6c*evw95f@2q6s%moh49+gaerd06^&a!*#y&=z8g3vt+=pew"
+    dest: /tmp/alwaysdata-snapshot.json
+  delegate_to: localhost
+"""
+
+RETURN = r"""
+dest:
+    description: Path of the snapshot file
+    type: str
+domains:
+    description: Number of domains in the snapshot
+    type: int
+records:
+    description: Number of DNS records in the snapshot
+    type: int
+"""
+
+
+MODULE_ARGS = dict(
+    token=dict(type="str", required=True, no_log=True),
+    dest=dict(type="path", required=True),
+    **api_argument_spec(),
+)
+
+
+def snapshot():
+    module = AnsibleModule(argument_spec=MODULE_ARGS, supports_check_mode=True)
+
+    token = module.params["token"]
+    dest = module.params["dest"]
+
+    domains = list_domains(module, token)
+    records = list_records(module, token)
+
+    result = {
+        "changed": True,
+        "dest": dest,
+        "domains": len(domains),
+        "records": len(records),
+    }
+
+    try:
+        with open(dest, "r") as stream:
+            previous = json.load(stream)
+        result["changed"] = previous != {
+            "version": SNAPSHOT_VERSION,
+            "domains": domains,
+            "records": records,
+        }
+    except (OSError, ValueError):
+        pass
+
+    if result["changed"] and not module.check_mode:
+        dump_snapshot(dest, domains, records)
+
+    return module.exit_json(**with_metrics(module, result))
+
+
+def main():
+    snapshot()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Synthetic accounts shaped like the fixtures of ``tests/unit/test_dnsrecord.py``."""
+
+from itertools import cycle
+
+RECORDS_PER_DOMAIN = 100
+
+IPS = ("12.102.160.30", "6b39:4323:4a95:8bd3:79fb:23da:a6b0:1dec")
+
+
+def build_account(size):
+    """Returns ``(domains, records)`` with ``size`` records spread over many domains.
+
+    Every domain holds ``RECORDS_PER_DOMAIN`` records cycling through A, AAAA, MX and TXT records
+    on a handful of names, so that filters match a realistic share of the account.
+    """
+    domain_count = max(1, size // RECORDS_PER_DOMAIN)
+    domains = [
+        {
+            "id": 10000 + index,
+            "name": "example{}.test".format(index),
+            "href": "/v1/domain/{}/".format(10000 + index),
+            "annotation": "Lorem ipsum",
+        }
+        for index in range(domain_count)
+    ]
+
+    kinds = cycle(
+        (
+            ("A", IPS[0], None),
+            ("AAAA", IPS[1], None),
+            ("MX", "mail.example.test", 10),
+            ("TXT", "v=spf1 include:_spf.example.test -all", None),
+        )
+    )
+    names = cycle(("git", "ansible", "wololo", "www", "mail", ""))
+    records = []
+    for index in range(size):
+        record_id = 100000 + index
+        rtype, value, priority = next(kinds)
+        records.append(
+            {
+                "id": record_id,
+                "domain": {"href": domains[index % domain_count]["href"]},
+                "type": rtype,
+                "name": next(names),
+                "value": value,
+                "priority": priority,
+                "ttl": 300,
+                "href": "/v1/record/{}/".format(record_id),
+                "annotation": "",
+                "is_user_defined": False,
+                "is_active": True,
+            }
+        )
+
+    return domains, records
+
+
+def build_record_set(size):
+    """Returns ``(existing, desired)`` record sets of ``size`` A records in the API format.
+
+    A third of the set is unchanged, a third only needs its TTL fixed and the last third is
+    replaced by new values, so that every step of the reconciliation is exercised.
+    """
+    ips = [
+        "10.{}.{}.{}".format(index >> 16 & 255, index >> 8 & 255, index & 255)
+        for index in range(2 * size)
+    ]
+    existing = [
+        {"id": 100000 + index, "type": "A", "name": "www", "value": ips[index], "ttl": 300}
+        for index in range(size)
+    ]
+    desired = [
+        {
+            "type": "A",
+            "name": "www",
+            "value": ips[index if index < 2 * size // 3 else size + index],
+            "ttl": 300 if index < size // 3 else 600,
+        }
+        for index in range(size)
+    ]
+    return existing, desired
@@ -0,0 +1,258 @@
+"""Micro-benchmarks of the pure-Python hot paths of the ``dnsrecord`` module.
+
+Each operation runs on synthetic accounts of increasing size. Its best time and its peak
+allocation are compared to ``baseline.json``.
+
+Timings only compare on the machine they were recorded on, so ``baseline.json`` stores the
+environment it was recorded in: times are only checked when the benchmarks run in the same
+environment, peak allocations whenever the Python version is the same. Record a baseline on the
+machine running the benchmarks with ``ALWAYSDATA_BENCH_UPDATE=1`` before comparing changes.
+
+The benchmarks measure wall-clock time, so they are skipped unless they are explicitly enabled.
+
+Environment variables:
+
+- ``ALWAYSDATA_BENCH``: set to ``1`` to run the benchmarks.
+- ``ALWAYSDATA_BENCH_SIZES``: comma separated account sizes, ``1000,10000`` by default. Add
+  ``100000`` for the full suite.
+- ``ALWAYSDATA_BENCH_TOLERANCE``: allowed ratio to the baseline before failing, ``1.5`` by
+  default.
+- ``ALWAYSDATA_BENCH_UPDATE``: set to ``1`` to store the measures as the new baseline.
+
+Run with ``ALWAYSDATA_BENCH=1 python -m pytest tests/benchmarks`` from the collection root.
+"""
+
+import gc
+import json
+import os
+import platform
+import time
+import tracemalloc
+import unittest
+
+from ansible_collections.christophehenry.alwaysdata.plugins.modules import dnsrecord
+
+from .datasets import build_account, build_record_set
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SIZES = [int(it) for it in os.environ.get("ALWAYSDATA_BENCH_SIZES", "1000,10000").split(",")]
+TOLERANCE = float(os.environ.get("ALWAYSDATA_BENCH_TOLERANCE", "1.5"))
+UPDATE = os.environ.get("ALWAYSDATA_BENCH_UPDATE") == "1"
+ENABLED = os.environ.get("ALWAYSDATA_BENCH") == "1" or UPDATE
+REPEAT = 5
+# Times over the tolerance are measured again this many times before failing, as a slowdown of
+# the machine usually lasts longer than a single measure
+RETRIES = 2
+# Each timing runs the operation enough times to last at least this long, in seconds
+MIN_DURATION = 0.05
+
+
+class StubModule(object):
+    """Just enough of ``AnsibleModule`` to run the state functions in check mode."""
+
+    def __init__(self, **params):
+        self.params = {
+            "domain": "example0.test",
+            "name": None,
+            "type": None,
+            "value": None,
+            "regex": None,
+            "priority": None,
+            "ttl": None,
+            "annotation": None,
+            "state": "present",
+            "snapshot": None,
+            "wait_for_propagation": False,
+            **params,
+        }
+        self.check_mode = True
+
+    def exit_json(self, **result):
+        return result
+
+    def fail_json(self, **result):
+        raise AssertionError(result)
+
+
+def environment():
+    return {
+        "python": "{} {}".format(
+            platform.python_implementation(), ".".join(platform.python_version_tuple()[:2])
+        ),
+        "machine": "{} {}".format(platform.node(), platform.machine()),
+    }
+
+
+def timing(operation, number):
+    # Like timeit, collections are left out of the measure: they depend on the whole process
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(number):
+            operation()
+        return (time.perf_counter() - started) / number
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def measure(operation):
+    """Returns the best time per run out of ``REPEAT`` timings and the peak allocation of one run.
+
+    Fast operations are repeated within each timing so that timer resolution and scheduling
+    noise don't dominate their measure.
+    """
+    number = 1
+    while timing(operation, number) * number < MIN_DURATION:
+        number *= 2
+    timings = [timing(operation, number) for _ in range(REPEAT)]
+
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(timings), peak
+
+
+@unittest.skipUnless(ENABLED, "set ALWAYSDATA_BENCH=1 to run the benchmarks")
+class TestHotPaths(unittest.TestCase):
+    measures = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.environment = environment()
+        try:
+            with open(BASELINE, "r") as stream:
+                baseline = json.load(stream)
+        except FileNotFoundError:
+            baseline = {}
+        recorded = baseline.get("environment") or {}
+        cls.baseline = baseline.get("measures") or {}
+        cls.same_python = recorded.get("python") == cls.environment["python"]
+        cls.same_machine = cls.same_python and recorded.get("machine") == cls.environment["machine"]
+
+    @classmethod
+    def tearDownClass(cls):
+        if UPDATE:
+            # Measures recorded elsewhere can't be compared with the new ones
+            measures = {**cls.baseline, **cls.measures} if cls.same_machine else cls.measures
+            with open(BASELINE, "w") as stream:
+                json.dump(
+                    {"environment": cls.environment, "measures": measures},
+                    stream,
+                    indent=2,
+                    sort_keys=True,
+                )
+                stream.write("\n")
+
+    def check(self, name, size, operation):
+        elapsed, peak = measure(operation)
+        key = "{}[{}]".format(name, size)
+        current = {"time": round(elapsed, 6), "peak_bytes": peak}
+        type(self).measures[key] = current
+
+        reference = self.baseline.get(key)
+        if UPDATE or reference is None or not self.same_python:
+            return
+
+        if self.same_machine:
+            for _ in range(RETRIES):
+                if current["time"] <= reference["time"] * TOLERANCE:
+                    break
+                current["time"] = min(current["time"], round(measure(operation)[0], 6))
+            self.assertLessEqual(
+                current["time"],
+                reference["time"] * TOLERANCE,
+                "{} regressed: {:.6f}s vs {:.6f}s".format(key, current["time"], reference["time"]),
+            )
+        self.assertLessEqual(
+            current["peak_bytes"],
+            reference["peak_bytes"] * TOLERANCE,
+            "{} allocates more: {} vs {} bytes".format(
+                key, current["peak_bytes"], reference["peak_bytes"]
+            ),
+        )
+
+    def account(self, size):
+        domains, records = build_account(size)
+        return dnsrecord.Domain(**domains[0]), records
+
+    def test_filter_record(self):
+        for size in SIZES:
+            domain, records = self.account(size)
+            for state, params in (
+                ("present", {"name": "git", "type": "A", "value": "12.102.160.31"}),
+                ("absent", {"name": "git", "value": "12.102.160.30"}),
+                ("regex", {"name": "", "type": "TXT", "regex": r"v=spf1"}),
+            ):
+                module = StubModule(state="absent" if state == "absent" else "present", **params)
+                with self.subTest(state=state, size=size):
+                    self.check(
+                        "filter_record_{}".format(state),
+                        size,
+                        lambda: [
+                            it for it in records if dnsrecord.filter_record(module, domain, it)
+                        ],
+                    )
+
+    def test_to_api_params(self):
+        for size in SIZES:
+            domain, records = self.account(size)
+            with self.subTest(size=size):
+                self.check(
+                    "to_api_params",
+                    size,
+                    lambda: [
+                        dnsrecord.ApiParams(**{**it, "domain": domain}).to_api_params()
+                        for it in records
+                    ],
+                )
+
+    def test_state_present(self):
+        for size in SIZES:
+            domain, records = self.account(size)
+            module = StubModule(name="git", type="A", value="12.102.160.31", ttl=300)
+            with self.subTest(size=size):
+                self.check(
+                    "state_present",
+                    size,
+                    lambda: dnsrecord.state_present(module, None, domain, records),
+                )
+
+    def test_plan_record_set(self):
+        for size in SIZES:
+            existing, desired = build_record_set(size)
+            with self.subTest(size=size):
+                self.check(
+                    "plan_record_set",
+                    size,
+                    lambda: dnsrecord.plan_record_set(existing, desired),
+                )
+
+    def test_state_present_values(self):
+        for size in SIZES:
+            domain, records = self.account(size)
+            filtered = [it for it in records if it["type"] == "A" and it["name"] == "git"]
+            values = ["12.102.160.{}".format(index) for index in range(30, 40)]
+            module = StubModule(name="git", type="A", values=values, ttl=300)
+            with self.subTest(size=size):
+                self.check(
+                    "state_present_values",
+                    size,
+                    lambda: dnsrecord.state_present(module, None, domain, filtered),
+                )
+
+    def test_state_absent(self):
+        for size in SIZES:
+            domain, records = self.account(size)
+            module = StubModule(name="git", state="absent")
+            with self.subTest(size=size):
+                self.check(
+                    "state_absent",
+                    size,
+                    lambda: dnsrecord.state_absent(module, None, domain, records),
+                )
@@ -0,0 +1,136 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils import agent
+
+
+class TestAgent(unittest.TestCase):
+    def setUp(self):
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "agent.sock")
+
+        self.server = agent.AgentServer(self.path, idle_timeout=60, cache_ttl=60)
+        self.server.pool = mock.Mock()
+        self.server.pool.request.return_value = (200, {"Content-Type": "application/json"}, "[]")
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def request(self, method, route, data=None):
+        return agent.agent_request(
+            self.path,
+            {"token": self.token, "route": route, "method": method, "data": data, "headers": {}},
+        )
+
+    def test_listings_are_cached_until_written(self):
+        self.assertTrue(agent.ping(self.path))
+
+        self.assertEqual(
+            {
+                "status": 200,
+                "headers": {"content-type": "application/json"},
+                "body": "[]",
+                "cached": False,
+            },
+            self.request("GET", "/record/"),
+        )
+        self.assertTrue(self.request("GET", "/record/")["cached"])
+        self.assertTrue(self.request("GET", "/domain/")["cached"] is False)
+        self.assertEqual(2, self.server.pool.request.call_count)
+
+        self.server.pool.request.return_value = (204, {}, "")
+        self.assertEqual(204, self.request("DELETE", "/record/1234/")["status"])
+
+        self.server.pool.request.return_value = (200, {}, "[]")
+        self.assertFalse(self.request("GET", "/record/")["cached"])
+        self.assertTrue(self.request("GET", "/domain/")["cached"])
+
+    def test_authorization(self):
+        self.request("GET", "/domain/")
+
+        method, url = self.server.pool.request.call_args.args
+        self.assertEqual(("GET", "/v1/domain/"), (method, url))
+        self.assertTrue(
+            self.server.pool.request.call_args.kwargs["headers"]["Authorization"].startswith(
+                "Basic "
+            )
+        )
+
+    def test_timeouts_are_forwarded(self):
+        agent.agent_request(
+            self.path,
+            {
+                "token": self.token,
+                "route": "/domain/",
+                "method": "GET",
+                "headers": {},
+                "connect_timeout": 3,
+                "read_timeout": 7,
+            },
+        )
+
+        self.assertEqual(
+            (3, 7),
+            (
+                self.server.pool.request.call_args.kwargs["connect_timeout"],
+                self.server.pool.request.call_args.kwargs["read_timeout"],
+            ),
+        )
+
+    def test_connection_timeouts(self):
+        pool = agent.ConnectionPool("api.example.test")
+        connection = mock.Mock(sock=None, will_close=True)
+        connection.connect.side_effect = lambda: setattr(connection, "sock", mock.Mock())
+        connection.getresponse.return_value.getheaders.return_value = []
+        connection.getresponse.return_value.getheader.return_value = None
+        connection.getresponse.return_value.read.side_effect = [b"[]", b""]
+
+        with mock.patch(f"{agent.__name__}.http.client.HTTPSConnection", return_value=connection):
+            pool.request("GET", "/v1/domain/", connect_timeout=3, read_timeout=7)
+
+        self.assertEqual(3, connection.timeout)
+        self.assertEqual([mock.call(3), mock.call(7)], connection.sock.settimeout.call_args_list)
+
+    def test_errors_are_forwarded(self):
+        self.server.pool.request.side_effect = ConnectionRefusedError("refused")
+        self.assertEqual(
+            {"error": "ConnectionRefusedError: refused"}, self.request("POST", "/record/", "{}")
+        )
+
+    def test_agent_query(self):
+        with mock.patch(f"{agent.__name__}.spawn", return_value=True):
+            self.assertEqual(
+                "[]",
+                agent.agent_query(
+                    self.token,
+                    "/record/",
+                    method="GET",
+                    data=None,
+                    headers={},
+                    idle_timeout=60,
+                    cache_ttl=60,
+                    path=self.path,
+                )["body"],
+            )
+
+            self.server.pool.request.side_effect = ConnectionRefusedError("refused")
+            with self.subTest("Failed reads fall back to a direct request"):
+                self.assertIsNone(
+                    agent.agent_query(
+                        self.token,
+                        "/domain/",
+                        method="GET",
+                        data=None,
+                        headers={},
+                        idle_timeout=60,
+                        cache_ttl=60,
+                        path=self.path,
+                    )
+                )
@@ -0,0 +1,375 @@
+import gzip
+import http.client
+import http.server
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+import zlib
+from unittest import mock
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils import alwaysdata
+
+
+class TestApiQuery(unittest.TestCase):
+    def setUp(self):
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        self.module = mock.Mock(params={"agent": False, "cassette": None}, _verbosity=0)
+        self.module.fail_json.side_effect = AssertionError
+        self.records = [
+            {"id": record_id, "type": "A", "name": "git", "value": "12.102.160.30"}
+            for record_id in range(2000)
+        ]
+        self.payload = json.dumps(self.records).encode("utf-8")
+
+    def fetch(self, body, encoding=None, status=200):
+        info = {"status": status, "url": "https://api.alwaysdata.com/v1/record/"}
+        if encoding:
+            info["content-encoding"] = encoding
+        return mock.patch(f"{alwaysdata.__name__}.fetch_url", return_value=(io.BytesIO(body), info))
+
+    def test_compressed_responses(self):
+        raw_deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        for encoding, body in (
+            (None, self.payload),
+            ("identity", self.payload),
+            ("gzip", gzip.compress(self.payload)),
+            ("deflate", zlib.compress(self.payload)),
+            ("deflate", raw_deflate.compress(self.payload) + raw_deflate.flush()),
+        ):
+            with self.subTest(encoding=encoding, size=len(body)):
+                with self.fetch(body, encoding) as fetch_url_mock:
+                    self.assertEqual(
+                        self.records, alwaysdata.api_query(self.module, self.token, "record")
+                    )
+
+                self.assertEqual(
+                    "gzip, deflate", fetch_url_mock.call_args.kwargs["headers"]["Accept-Encoding"]
+                )
+                self.assertFalse(fetch_url_mock.call_args.kwargs["decompress"])
+
+    def test_corrupted_response(self):
+        with self.fetch(b"not gzip", "gzip"):
+            with self.assertRaises(AssertionError):
+                alwaysdata.api_query(self.module, self.token, "record")
+
+        self.assertEqual(
+            "Unable to decode the server's response.",
+            self.module.fail_json.call_args.kwargs["msg"],
+        )
+
+    def test_read_text_streams(self):
+        stream = io.BytesIO(gzip.compress("é".encode("utf-8") * 10000))
+        self.assertEqual("é" * 10000, alwaysdata.read_text(stream, "gzip", chunk_size=7))
+
+
+class TestCassette(unittest.TestCase):
+    def setUp(self):
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "cassette.json")
+
+    def module(self, mode, timing="none"):
+        module = mock.Mock(
+            params={
+                "agent": False,
+                "cassette": self.path,
+                "cassette_mode": mode,
+                "cassette_timing": timing,
+            },
+            _verbosity=0,
+        )
+        module.jsonify = json.dumps
+        module.fail_json.side_effect = AssertionError
+        return module
+
+    def test_record_and_replay(self):
+        responses = [b"[]", json.dumps([{"id": 1, "token": self.token}]).encode("utf-8")]
+        module = self.module("record")
+        with mock.patch(
+            f"{alwaysdata.__name__}.fetch_url",
+            side_effect=[
+                (io.BytesIO(body), {"status": 200, "content-type": "application/json"})
+                for body in responses
+            ],
+        ):
+            self.assertEqual([], alwaysdata.api_query(module, self.token, "record"))
+            self.assertEqual(
+                [{"id": 1, "token": self.token}],
+                alwaysdata.api_query(module, self.token, "record"),
+            )
+
+        with open(self.path) as stream:
+            content = stream.read()
+        self.assertNotIn(self.token, content)
+        lines = content.splitlines()
+        self.assertEqual({"version": 2}, json.loads(lines[0]))
+        self.assertEqual(2, len(lines[1:]))
+
+        module = self.module("replay")
+        cassette = alwaysdata.get_cassette(module)
+        with (
+            mock.patch(f"{alwaysdata.__name__}.fetch_url") as fetch_url_mock,
+            mock.patch.object(
+                cassette, "interactions", wraps=cassette.interactions
+            ) as interactions_mock,
+        ):
+            with self.subTest("Interactions are replayed in order"):
+                self.assertEqual([], alwaysdata.api_query(module, self.token, "record"))
+                self.assertEqual(
+                    [{"id": 1, "token": "<redacted>"}],
+                    alwaysdata.api_query(module, self.token, "record"),
+                )
+
+            with self.subTest("The last interaction is served once all were replayed"):
+                self.assertEqual(
+                    [{"id": 1, "token": "<redacted>"}],
+                    alwaysdata.api_query(module, self.token, "record"),
+                )
+
+            with self.subTest("Unknown requests fail"):
+                with self.assertRaises(AssertionError):
+                    alwaysdata.api_query(module, self.token, "domain")
+
+        fetch_url_mock.assert_not_called()
+        # The cassette is read once per process
+        interactions_mock.assert_called_once()
+
+    def write_cassette(self, *interactions):
+        with open(self.path, "w") as stream:
+            stream.write(json.dumps({"version": 2}) + "\n")
+            for body, elapsed in interactions:
+                request = {"method": "GET", "route": "/record/", "data": None}
+                response = {"status": 200, "headers": {}, "body": body}
+                stream.write(
+                    json.dumps({"request": request, "response": response, "elapsed": elapsed})
+                    + "\n"
+                )
+
+    def test_replay_state_is_shared(self):
+        self.write_cassette(("[1]", 0), ("[2]", 0), ("[3]", 0))
+        module = self.module("replay")
+        cassette = alwaysdata.get_cassette(module)
+
+        self.assertEqual([1], alwaysdata.api_query(module, self.token, "record"))
+
+        # Another task replayed the second interaction
+        with open(self.path + ".state", "a") as stream:
+            stream.write("1\n")
+        self.assertEqual([3], alwaysdata.api_query(module, self.token, "record"))
+
+        # The state file is only read from where the last read stopped
+        self.assertEqual(os.path.getsize(self.path + ".state"), cassette.state_offset)
+        self.assertEqual({0, 1, 2}, cassette.replayed)
+
+    def test_replay_latency_is_bounded_by_the_task(self):
+        self.write_cassette(("[]", 30))
+        module = self.module("replay", timing="original")
+        module.params["task_timeout"] = 60
+        alwaysdata.task_state(module)["started"] -= 59.9
+
+        started = time.monotonic()
+        with self.assertRaises(AssertionError):
+            alwaysdata.api_query(module, self.token, "record")
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual(
+            "Task timeout of 60 seconds exceeded while waiting for GET /record/.",
+            module.fail_json.call_args.kwargs["msg"],
+        )
+
+    def test_unsupported_format(self):
+        with open(self.path, "w") as stream:
+            json.dump({"version": 1, "interactions": []}, stream, indent=2)
+
+        module = self.module("replay")
+        with self.assertRaises(AssertionError):
+            alwaysdata.api_query(module, self.token, "record")
+
+        self.assertIn("Unsupported cassette format", module.fail_json.call_args.kwargs["msg"])
+
+
+class TestTimeouts(unittest.TestCase):
+    def setUp(self):
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        self.module = mock.Mock(
+            params={
+                "agent": False,
+                "cassette": None,
+                "connect_timeout": 10,
+                "read_timeout": 30,
+                "task_timeout": 60,
+            },
+            _verbosity=0,
+        )
+        self.module.jsonify = json.dumps
+        self.module.fail_json.side_effect = AssertionError
+
+    def fetch(self, *responses):
+        return mock.patch(
+            f"{alwaysdata.__name__}.fetch_url",
+            side_effect=[(io.BytesIO(body), {"status": status}) for status, body in responses],
+        )
+
+    def test_timeouts_are_bounded_by_the_task(self):
+        with self.fetch((200, b"[]"), (200, b"[]")) as fetch_url_mock:
+            alwaysdata.api_query(self.module, self.token, "record")
+            self.assertEqual(10, fetch_url_mock.call_args.kwargs["timeout"])
+
+            alwaysdata.task_state(self.module)["started"] -= 55
+            alwaysdata.api_query(self.module, self.token, "record")
+            self.assertLessEqual(fetch_url_mock.call_args.kwargs["timeout"], 5)
+
+    def test_deadline_fails_with_completed_writes(self):
+        with self.fetch((201, b""), (204, b"")) as fetch_url_mock:
+            alwaysdata.api_query(
+                self.module, self.token, "record", method="POST", data={"value": "1"}
+            )
+            alwaysdata.api_query(self.module, self.token, "record/42", method="DELETE")
+
+            alwaysdata.task_state(self.module)["started"] -= 60
+            with self.assertRaises(AssertionError):
+                alwaysdata.api_query(self.module, self.token, "record/43", method="DELETE")
+
+        self.assertEqual(2, fetch_url_mock.call_count)
+        self.assertEqual(
+            {
+                "msg": (
+                    "Task timeout of 60 seconds exceeded before DELETE /record/43/ could be sent."
+                ),
+                "completed": [
+                    {"method": "POST", "route": "record"},
+                    {"method": "DELETE", "route": "record/42"},
+                ],
+            },
+            self.module.fail_json.call_args.kwargs,
+        )
+
+    def test_errors_report_completed_writes(self):
+        with self.fetch((201, b""), (500, b"")):
+            alwaysdata.api_query(
+                self.module, self.token, "record", method="POST", data={"value": "1"}
+            )
+            with self.assertRaises(AssertionError):
+                alwaysdata.api_query(self.module, self.token, "record/42", method="DELETE")
+
+        self.assertEqual(
+            [{"method": "POST", "route": "record"}],
+            self.module.fail_json.call_args.kwargs["completed"],
+        )
+
+    def test_agent_timeouts(self):
+        self.module.params.update(agent=True, agent_idle_timeout=60, agent_cache_ttl=60)
+
+        def agent_query(*args, **kwargs):
+            # The write times out once the task's budget is spent
+            alwaysdata.task_state(self.module)["started"] -= 60
+            return {"error": "timed out"}
+
+        with mock.patch(
+            f"{alwaysdata.__name__}.agent_query", side_effect=agent_query
+        ) as agent_query_mock:
+            with self.assertRaises(AssertionError):
+                alwaysdata.api_query(self.module, self.token, "record/42", method="DELETE")
+
+        self.assertEqual(
+            (10, 30, 40),
+            tuple(
+                agent_query_mock.call_args.kwargs[key]
+                for key in ("connect_timeout", "read_timeout", "timeout")
+            ),
+        )
+        self.assertEqual(
+            "Task timeout of 60 seconds exceeded while waiting for DELETE /record/42/.",
+            self.module.fail_json.call_args.kwargs["msg"],
+        )
+
+    def test_response_socket(self):
+        server = http.server.HTTPServer(("127.0.0.1", 0), http.server.SimpleHTTPRequestHandler)
+        self.addCleanup(server.server_close)
+        thread = threading.Thread(target=server.handle_request)
+        thread.start()
+        self.addCleanup(thread.join)
+
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_port}/") as response:
+            stream = alwaysdata.BudgetedStream(self.module, response)
+            self.assertIsNotNone(stream.sock)
+            self.assertTrue(stream.read(16))
+            self.assertEqual(30, stream.sock.gettimeout())
+
+        self.module.warn.assert_not_called()
+
+        with self.subTest("A missing socket is reported"):
+            stream = alwaysdata.BudgetedStream(
+                self.module, mock.Mock(spec=http.client.HTTPResponse)
+            )
+            self.assertIsNone(stream.sock)
+            self.module.warn.assert_called_once()
+
+    def test_no_task_timeout(self):
+        self.module.params["task_timeout"] = None
+        with self.fetch((200, b"[]")) as fetch_url_mock:
+            alwaysdata.task_state(self.module)["started"] -= 10**6
+            self.assertEqual([], alwaysdata.api_query(self.module, self.token, "record"))
+
+        self.assertEqual(10, fetch_url_mock.call_args.kwargs["timeout"])
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        self.module = mock.Mock(
+            params={"agent": False, "cassette": None, "metrics": True, "domain": "example.test"},
+            _verbosity=0,
+        )
+        self.module.jsonify = json.dumps
+        self.module.fail_json.side_effect = AssertionError
+
+    def test_requests_are_recorded(self):
+        body = gzip.compress(b"[]")
+        with mock.patch(
+            f"{alwaysdata.__name__}.fetch_url",
+            side_effect=[
+                (io.BytesIO(body), {"status": 200, "content-encoding": "gzip"}),
+                (io.BytesIO(b""), {"status": 204}),
+            ],
+        ):
+            alwaysdata.api_query(self.module, self.token, "record")
+            alwaysdata.api_query(self.module, self.token, "record/42", method="PUT", data={})
+
+        requests = alwaysdata.with_metrics(self.module, {"changed": True})["alwaysdata_metrics"]
+        self.assertEqual("example.test", requests["domain"])
+        for entry in requests["requests"]:
+            self.assertGreaterEqual(entry.pop("elapsed"), 0)
+        self.assertEqual(
+            [
+                {
+                    "method": "GET",
+                    "route": "record",
+                    "status": 200,
+                    "source": "network",
+                    "bytes_sent": 0,
+                    "bytes_received": len(body),
+                    "retries": 0,
+                },
+                {
+                    "method": "PUT",
+                    "route": "record/{id}",
+                    "status": 204,
+                    "source": "network",
+                    "bytes_sent": 2,
+                    "bytes_received": 0,
+                    "retries": 0,
+                },
+            ],
+            requests["requests"],
+        )
+
+    def test_disabled(self):
+        self.module.params["metrics"] = False
+        self.assertEqual({"changed": True}, alwaysdata.with_metrics(self.module, {"changed": True}))
@@ -0,0 +1,138 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from ansible_collections.christophehenry.alwaysdata.plugins.callback import api_metrics
+
+
+def request(method="GET", route="record", elapsed=0.1, **kwargs):
+    return {
+        "method": method,
+        "route": route,
+        "status": 200,
+        "source": "network",
+        "bytes_sent": 0,
+        "bytes_received": 100,
+        "elapsed": elapsed,
+        "retries": 0,
+        **kwargs,
+    }
+
+
+class TestAggregate(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, api_metrics.percentile(values, 50))
+        self.assertEqual(90, api_metrics.percentile(values, 90))
+        self.assertEqual(99, api_metrics.percentile(values, 99))
+        self.assertEqual(7, api_metrics.percentile([7], 99))
+        self.assertEqual(0, api_metrics.percentile([], 50))
+
+    def test_aggregate(self):
+        requests = [
+            request(elapsed=1.0, task="List", domain="example.test"),
+            request(elapsed=0.5, source="agent_cache", task="List", domain="example2.test"),
+            request(
+                "PUT",
+                "record/{id}",
+                elapsed=2.0,
+                bytes_sent=50,
+                retries=1,
+                task="Update",
+                domain="example.test",
+            ),
+        ]
+
+        report = api_metrics.aggregate(requests)
+
+        self.assertEqual(
+            {
+                "requests": 3,
+                "bytes_sent": 50,
+                "bytes_received": 300,
+                "elapsed": 3.5,
+                "retries": 1,
+                "cache_hits": 1,
+                "errors": 0,
+                "p50": 1.0,
+                "p90": 2.0,
+                "p99": 2.0,
+            },
+            report["total"],
+        )
+        # Sections are sorted by time spent
+        self.assertEqual(["PUT record/{id}", "GET record"], list(report["routes"]))
+        self.assertEqual(["Update", "List"], list(report["tasks"]))
+        self.assertEqual(["example.test", "example2.test"], list(report["domains"]))
+        self.assertEqual(3.0, report["domains"]["example.test"]["elapsed"])
+
+
+class TestCallbackModule(unittest.TestCase):
+    def setUp(self):
+        self.callback = api_metrics.CallbackModule(display=mock.Mock(verbosity=0))
+        self.callback._plugin_options = {"output": None, "top": 10}
+
+    def result(self, content, task="Task"):
+        result = mock.Mock(_result=content)
+        result._task.get_name.return_value = task
+        result._host.get_name.return_value = "localhost"
+        return result
+
+    def test_collect_and_report(self):
+        metrics = {"domain": "example.test", "requests": [request()]}
+        self.callback.v2_runner_on_ok(self.result({"alwaysdata_metrics": metrics}))
+        self.callback.v2_runner_on_ok(
+            self.result({"results": [{"alwaysdata_metrics": metrics}, {"skipped": True}]}, "Loop")
+        )
+        self.callback.v2_runner_on_failed(self.result({"msg": "Nope"}))
+
+        self.assertEqual(
+            [("Task", "example.test"), ("Loop", "example.test")],
+            [(it["task"], it["domain"]) for it in self.callback.requests],
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "metrics.json")
+            self.callback._plugin_options["output"] = path
+            self.callback.v2_playbook_on_stats(mock.Mock())
+
+            with open(path) as stream:
+                plays = json.load(stream)["plays"]
+            self.assertEqual([None], [it["play"] for it in plays])
+            self.assertEqual(2, plays[0]["total"]["requests"])
+
+        self.callback._display.banner.assert_called_once_with("ALWAYSDATA API METRICS")
+
+    def test_report_per_play(self):
+        metrics = {"domain": "example.test", "requests": [request()]}
+        for name, count in (("First", 2), ("Empty", 0), ("Last", 1)):
+            self.callback.v2_playbook_on_play_start(mock.Mock(**{"get_name.return_value": name}))
+            for _ in range(count):
+                self.callback.v2_runner_on_ok(self.result({"alwaysdata_metrics": metrics}))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "metrics.json")
+            self.callback._plugin_options["output"] = path
+            self.callback.v2_playbook_on_stats(mock.Mock())
+
+            with open(path) as stream:
+                plays = json.load(stream)["plays"]
+
+        self.assertEqual(
+            [("First", 2), ("Last", 1)],
+            [(it["play"], it["total"]["requests"]) for it in plays],
+        )
+        self.assertEqual(
+            [
+                mock.call("ALWAYSDATA API METRICS [First]"),
+                mock.call("ALWAYSDATA API METRICS [Last]"),
+            ],
+            self.callback._display.banner.call_args_list,
+        )
+
+    def test_nothing_collected(self):
+        self.callback.v2_runner_on_ok(self.result({"changed": False}))
+        self.callback.v2_playbook_on_stats(mock.Mock())
+        self.callback._display.banner.assert_not_called()
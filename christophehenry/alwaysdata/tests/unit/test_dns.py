@@ -0,0 +1,92 @@
+import time
+import unittest
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils import dns
+
+from .utils import StubDNSServer
+
+
+class TestDNS(unittest.TestCase):
+    def test_query_many(self):
+        with StubDNSServer() as first, StubDNSServer() as second:
+            first.zone[("git.example.test", "A")] = ["12.102.160.30"]
+            second.zone[("git.example.test", "A")] = ["12.102.160.31", "12.102.160.32"]
+
+            self.assertEqual(
+                {
+                    first.address: ["12.102.160.30"],
+                    second.address: ["12.102.160.31", "12.102.160.32"],
+                },
+                dns.query_many([first.address, second.address], "git.example.test", "A", 1),
+            )
+
+    def test_normalize_value(self):
+        self.assertEqual(
+            "6b39:4323:4a95:8bd3:79fb:23da:a6b0:1dec",
+            dns.normalize_value("AAAA", "6b39:4323:4a95:8bd3:79fb:23da:a6b0:1DEC"),
+        )
+        self.assertEqual("mail.example.test", dns.normalize_value("MX", "Mail.Example.Test."))
+        self.assertEqual("v=spf1 -all", dns.normalize_value("TXT", '"v=spf1 -all"'))
+        self.assertEqual(
+            "v=DKIM1; k=rsa; p=MIGf",
+            dns.normalize_value("TXT", '"v=DKIM1; k=rsa; " "p=MIGf"'),
+        )
+        self.assertEqual(
+            dns.normalize_value("TXT", "v=DKIM1; k=rsa; p=MIGf"),
+            dns.normalize_value("TXT", '"v=DKIM1; k=rsa; " "p=MIGf"'),
+        )
+
+    def test_wait_for_values(self):
+        with StubDNSServer() as first, StubDNSServer() as second:
+            first.zone[("git.example.test", "TXT")] = ["new"]
+            second.zone[("git.example.test", "TXT")] = ["old"]
+            servers = [first.address, second.address]
+
+            with self.subTest("Timeout reports pending servers"):
+                self.assertEqual(
+                    [second.address],
+                    dns.wait_for_values(
+                        servers, "git.example.test", "TXT", ["new"], 0.3, initial_delay=0.05
+                    ),
+                )
+
+            with self.subTest("Returns as soon as every server serves the value"):
+                second.zone[("git.example.test", "TXT")] = ["old", "new"]
+                started = time.monotonic()
+                self.assertEqual(
+                    [],
+                    dns.wait_for_values(
+                        servers, "git.example.test", "TXT", ["new"], 10, initial_delay=0.05
+                    ),
+                )
+                self.assertLess(time.monotonic() - started, 1)
+
+            with self.subTest("Multi-string TXT values match their concatenation"):
+                first.zone[("dkim.example.test", "TXT")] = ["v=DKIM1; k=rsa; p=MIGf"]
+                self.assertEqual(
+                    [],
+                    dns.wait_for_values(
+                        [first.address],
+                        "dkim.example.test",
+                        "TXT",
+                        ['"v=DKIM1; k=rsa; " "p=MIGf"'],
+                        1,
+                        initial_delay=0.05,
+                    ),
+                )
+
+    def test_unreachable_servers(self):
+        with StubDNSServer() as server:
+            server.zone[("git.example.test", "A")] = ["12.102.160.30"]
+            servers = ["no-such-host.invalid", "127.0.0.1:notaport", server.address]
+
+            self.assertEqual(
+                {server.address: ["12.102.160.30"]},
+                dns.query_many(servers, "git.example.test", "A", 1),
+            )
+            self.assertEqual(
+                ["no-such-host.invalid", "127.0.0.1:notaport"],
+                dns.wait_for_values(
+                    servers, "git.example.test", "A", ["12.102.160.30"], 0.2, initial_delay=0.05
+                ),
+            )
@@ -0,0 +1,139 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from ansible_collections.christophehenry.alwaysdata.plugins.modules import dnsdrift
+
+from .utils import AlwaysDataTestModule, AnsibleExitJson, AnsibleFailJson
+
+
+class TestDNSDriftModule(AlwaysDataTestModule):
+    def setUp(self):
+        super().setUp()
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        self.domains = [
+            {"id": domain_id, "name": name, "href": f"/v1/domain/{domain_id}/"}
+            for domain_id, name in ((1234, "example.test"), (5678, "example2.test"))
+        ]
+        self.records = [
+            {
+                "id": record_id,
+                "domain": {"href": href},
+                "type": "A",
+                "name": name,
+                "value": "12.102.160.30",
+                "priority": None,
+                "ttl": 300,
+                "href": f"/v1/record/{record_id}/",
+                "annotation": "",
+            }
+            for record_id, (href, name) in enumerate(
+                (
+                    (domain["href"], name)
+                    for domain in self.domains
+                    for name in ("git", "ansible", "wololo")
+                ),
+                start=10000,
+            )
+        ]
+
+    def run_module(self, args, records):
+        self.set_module_args({"token": self.token, **args})
+        with mock.patch(f"{dnsdrift.__name__}.list_domains", return_value=self.domains):
+            with mock.patch(f"{dnsdrift.__name__}.list_records", return_value=records):
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsdrift.main()
+
+        return e.exception.args[0]
+
+    def test_record_hashes_are_order_independent(self):
+        hashes = dnsdrift.record_hashes(self.domains, self.records)
+        self.assertEqual(hashes, dnsdrift.record_hashes(self.domains, self.records[::-1]))
+        self.assertEqual(["example.test", "example2.test"], sorted(hashes))
+        self.assertEqual({"git", "ansible", "wololo"}, set(hashes["example.test"]["names"]))
+
+    def test_null_values(self):
+        self.records[0]["value"] = None
+        hashes = dnsdrift.record_hashes(self.domains, self.records)
+        self.assertIn("git", hashes["example.test"]["names"])
+
+    def test_invalid_baselines(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            baseline = os.path.join(tmpdir, "baseline.json")
+            for content in ([], "baseline", None, {"version": dnsdrift.BASELINE_VERSION}):
+                with self.subTest(content=content):
+                    with open(baseline, "w") as stream:
+                        json.dump(content, stream)
+
+                    self.set_module_args({"token": self.token, "baseline": baseline})
+                    with mock.patch(f"{dnsdrift.__name__}.list_domains", return_value=self.domains):
+                        with mock.patch(
+                            f"{dnsdrift.__name__}.list_records", return_value=self.records
+                        ):
+                            with self.assertRaises(AnsibleFailJson) as e:
+                                dnsdrift.main()
+
+                    self.assertIn("Unsupported baseline format", e.exception.args[0]["msg"])
+
+    def test_drift(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            baseline = os.path.join(tmpdir, "baseline.json")
+
+            with self.subTest("Missing baseline reports every domain"):
+                result = self.run_module({"baseline": baseline}, self.records)
+                self.assertEqual(["example.test", "example2.test"], result["drifted"])
+                self.assertFalse(result["changed"])
+                self.assertFalse(os.path.exists(baseline))
+
+            with self.subTest("Baseline is stored"):
+                result = self.run_module(
+                    {"baseline": baseline, "update_baseline": True}, self.records
+                )
+                self.assertTrue(result["changed"])
+                with open(baseline) as stream:
+                    self.assertEqual(1, json.load(stream)["version"])
+
+            with self.subTest("No drift"):
+                result = self.run_module(
+                    {"baseline": baseline, "update_baseline": True}, self.records
+                )
+                self.assertEqual({"changed": False, "drifted": [], "drift": {}}, result)
+
+            with self.subTest("Only the changed name is reported"):
+                records = [dict(it) for it in self.records]
+                records[0]["value"] = "12.102.160.31"
+                result = self.run_module({"baseline": baseline}, records)
+
+                self.assertEqual(["example.test"], result["drifted"])
+                self.assertEqual(
+                    {
+                        "git": {
+                            "before": [
+                                {
+                                    "type": "A",
+                                    "name": "git",
+                                    "value": "12.102.160.30",
+                                    "priority": None,
+                                    "ttl": 300,
+                                }
+                            ],
+                            "after": [
+                                {
+                                    "type": "A",
+                                    "name": "git",
+                                    "value": "12.102.160.31",
+                                    "priority": None,
+                                    "ttl": 300,
+                                }
+                            ],
+                        }
+                    },
+                    result["drift"]["example.test"],
+                )
+
+            with self.subTest("Unchecked domains are ignored"):
+                result = self.run_module(
+                    {"baseline": baseline, "domains": ["example2.test"]}, records
+                )
+                self.assertEqual([], result["drifted"])
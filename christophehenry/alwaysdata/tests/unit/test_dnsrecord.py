@@ -1,12 +1,16 @@
+import json
+import os
+import tempfile
 import unittest
 from collections import OrderedDict
 from datetime import datetime, timezone, timedelta
 from random import randint
 from unittest import mock
 
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils import alwaysdata
 from ansible_collections.christophehenry.alwaysdata.plugins.modules import dnsrecord
 
-from .utils import AlwaysDataTestModule, AnsibleFailJson, AnsibleExitJson
+from .utils import AlwaysDataTestModule, AnsibleFailJson, AnsibleExitJson, StubDNSServer
 
 
 class TestDNSRecordModule(AlwaysDataTestModule):
@@ -179,6 +183,19 @@ class TestDNSRecordModule(AlwaysDataTestModule):
                     e.exception.args[0],
                 )
 
+        with self.subTest("Invalid value fails before any API call"):
+            self.set_module_args({**self.correct_data, "value": "12.102.160"})
+
+            with unittest.mock.patch(f"{dnsrecord.__name__}.list_domains") as list_domains_mock:
+                with self.assertRaises(AnsibleFailJson) as e:
+                    dnsrecord.main()
+
+            list_domains_mock.assert_not_called()
+            self.assertEqual(
+                {"msg": "'12.102.160' is not a valid IPv4 address.", "failed": True},
+                e.exception.args[0],
+            )
+
         with self.subTest("Can't remove all records of the same type"):
             self.set_module_args(
                 {
@@ -374,3 +391,377 @@ class TestDNSRecordModule(AlwaysDataTestModule):
             state_absent_mock.assert_called_once_with(
                 mock.ANY, self.token, mock.ANY, records_to_remove
             )
+
+    @mock.patch(f"{dnsrecord.__name__}.api_query")
+    @mock.patch(f"{dnsrecord.__name__}.list_dnsrecord")
+    @mock.patch(f"{dnsrecord.__name__}.list_domains")
+    def test_snapshot_plan(
+        self,
+        list_domains_mock: mock.Mock,
+        list_dnsrecord_mock: mock.Mock,
+        api_query_mock: mock.Mock,
+    ):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "snapshot.json")
+            with open(path, "w") as stream:
+                json.dump(
+                    {"version": 1, "domains": list(self.domains.values()), "records": self.records},
+                    stream,
+                )
+
+            domain_id = self.domains[self.main_domain]["id"]
+            record = next(
+                it for it in self.main_domain_records if it["type"] == "A" and it["name"] == "git"
+            )
+
+            with self.subTest("Update is planned"):
+                data = {**self.correct_data, "value": "12.102.160.32", "snapshot": path}
+                del data["token"]
+                self.set_module_args(data)
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertTrue(e.exception.args[0]["changed"])
+                self.assertEqual(
+                    [
+                        {
+                            "method": "PUT",
+                            "route": f"record/{record['id']}",
+                            "data": {
+                                "domain": domain_id,
+                                "type": "A",
+                                "name": "git",
+                                "value": "12.102.160.32",
+                            },
+                        }
+                    ],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("Deletion is planned"):
+                self.set_module_args(
+                    {
+                        "domain": self.main_domain,
+                        "snapshot": path,
+                        "name": "git",
+                        "state": "absent",
+                    }
+                )
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    [
+                        {"method": "DELETE", "route": f"record/{it['id']}"}
+                        for it in self.main_domain_records
+                        if it["name"] == "git"
+                    ],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("Unchanged record plans nothing"):
+                data = {**self.correct_data, "snapshot": path, "ttl": 300}
+                self.set_module_args(data)
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertFalse(e.exception.args[0]["changed"])
+                self.assertEqual([], e.exception.args[0]["plan"])
+
+            for content in ({"version": 1}, {"version": 1, "domains": {}, "records": []}):
+                with self.subTest("Malformed snapshots fail", content=content):
+                    with open(path, "w") as stream:
+                        json.dump(content, stream)
+                    data = {**self.correct_data, "snapshot": path}
+                    del data["token"]
+                    self.set_module_args(data)
+
+                    with self.assertRaises(AnsibleFailJson) as e:
+                        dnsrecord.main()
+
+                    self.assertIn("Unsupported snapshot format", e.exception.args[0]["msg"])
+
+        list_domains_mock.assert_not_called()
+        list_dnsrecord_mock.assert_not_called()
+        api_query_mock.assert_not_called()
+
+    def test_plan_record_set(self):
+        existing = [
+            {"id": 1, "type": "A", "name": "www", "value": "10.0.0.1", "ttl": 300},
+            {"id": 2, "type": "A", "name": "www", "value": "10.0.0.2", "ttl": 300},
+            {"id": 3, "type": "A", "name": "www", "value": "10.0.0.3", "ttl": 600},
+            {"id": 4, "type": "A", "name": "www", "value": "10.0.0.4", "ttl": 300},
+        ]
+        desired = [
+            {"type": "A", "name": "www", "value": value, "ttl": 300}
+            for value in ("10.0.0.1", "10.0.0.3", "10.0.0.5")
+        ]
+
+        to_create, to_update, to_delete = dnsrecord.plan_record_set(existing, desired)
+
+        # 10.0.0.1 is kept, 10.0.0.3 only needs its TTL fixed and 10.0.0.5 reuses a record
+        self.assertEqual([], to_create)
+        self.assertEqual(
+            [(existing[2], desired[1]), (existing[1], desired[2])],
+            to_update,
+        )
+        self.assertEqual([existing[3]], to_delete)
+
+        with self.subTest("Growing a record set only creates"):
+            self.assertEqual(
+                ([desired[1], desired[2]], [], []),
+                dnsrecord.plan_record_set(existing[:1], desired),
+            )
+
+        with self.subTest("Same record set plans nothing"):
+            self.assertEqual(
+                ([], [], []),
+                dnsrecord.plan_record_set(
+                    existing[:2],
+                    [
+                        {"type": "A", "name": "www", "value": "10.0.0.2"},
+                        {"type": "A", "name": "www", "value": "10.0.0.1"},
+                    ],
+                ),
+            )
+
+    @mock.patch(f"{dnsrecord.__name__}.api_query")
+    @mock.patch(f"{dnsrecord.__name__}.list_dnsrecord")
+    @mock.patch(f"{dnsrecord.__name__}.list_domains")
+    def test_present_record_set(
+        self,
+        list_domains_mock: mock.Mock,
+        list_dnsrecord_mock: mock.Mock,
+        api_query_mock: mock.Mock,
+    ):
+        domain_id = self.domains[self.main_domain]["id"]
+        extra = {
+            **next(
+                it for it in self.main_domain_records if it["type"] == "A" and it["name"] == "git"
+            ),
+            "id": 1,
+            "value": "12.102.160.31",
+        }
+        records = [*self.records, extra, {**extra, "id": 2, "value": "12.102.160.32"}]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "snapshot.json")
+            with open(path, "w") as stream:
+                json.dump(
+                    {"version": 1, "domains": list(self.domains.values()), "records": records},
+                    stream,
+                )
+
+            data = {**self.correct_data, "snapshot": path}
+            del data["token"], data["value"]
+
+            with self.subTest("Only the difference is planned"):
+                self.set_module_args(
+                    {**data, "values": [self.ips[0], "12.102.160.32", "12.102.160.33"]}
+                )
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    [
+                        {
+                            "method": "PUT",
+                            "route": "record/1",
+                            "data": {
+                                "domain": domain_id,
+                                "type": "A",
+                                "name": "git",
+                                "value": "12.102.160.33",
+                            },
+                        }
+                    ],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("Extra records are deleted"):
+                self.set_module_args({**data, "values": [self.ips[0]]})
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    [
+                        {"method": "DELETE", "route": "record/1"},
+                        {"method": "DELETE", "route": "record/2"},
+                    ],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("A single value doesn't touch the rest of the set"):
+                self.set_module_args({**data, "value": "12.102.160.31"})
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual([], e.exception.args[0]["plan"])
+                self.assertFalse(e.exception.args[0]["changed"])
+
+            with self.subTest("A single value only updates the record holding it"):
+                self.set_module_args({**data, "value": "12.102.160.31", "ttl": 600})
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    [
+                        {
+                            "method": "PUT",
+                            "route": "record/1",
+                            "data": {
+                                "domain": domain_id,
+                                "type": "A",
+                                "name": "git",
+                                "value": "12.102.160.31",
+                                "ttl": 600,
+                            },
+                        }
+                    ],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("A new single value rewrites one record"):
+                self.set_module_args({**data, "value": "12.102.160.33"})
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                first = next(
+                    it
+                    for it in records
+                    if it["domain"] == extra["domain"] and it["type"] == "A" and it["name"] == "git"
+                )
+                self.assertEqual(
+                    [
+                        {
+                            "method": "PUT",
+                            "route": f"record/{first['id']}",
+                            "data": {
+                                "domain": domain_id,
+                                "type": "A",
+                                "name": "git",
+                                "value": "12.102.160.33",
+                            },
+                        }
+                    ],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("Only the listed values are removed"):
+                self.set_module_args({**data, "state": "absent", "values": ["12.102.160.31"]})
+
+                with self.assertRaises(AnsibleExitJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    [{"method": "DELETE", "route": "record/1"}],
+                    e.exception.args[0]["plan"],
+                )
+
+            with self.subTest("value and values are mutually exclusive"):
+                self.set_module_args({**data, "value": self.ips[0], "values": [self.ips[0]]})
+
+                with self.assertRaises(AnsibleFailJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    "parameters are mutually exclusive: value|values",
+                    e.exception.args[0]["msg"],
+                )
+
+        list_domains_mock.assert_not_called()
+        list_dnsrecord_mock.assert_not_called()
+        api_query_mock.assert_not_called()
+
+    @mock.patch(f"{dnsrecord.__name__}.create_dnsrecord")
+    @mock.patch(f"{dnsrecord.__name__}.list_dnsrecord")
+    @mock.patch(f"{dnsrecord.__name__}.list_domains")
+    def test_present_wait_for_propagation(
+        self,
+        list_domains_mock: mock.Mock,
+        list_dnsrecord_mock: mock.Mock,
+        create_dnsrecord_mock: mock.Mock,
+    ):
+        list_domains_mock.return_value = list(self.domains.values())
+        list_dnsrecord_mock.return_value = list(self.main_domain_records)
+
+        with StubDNSServer() as nameserver, StubDNSServer() as resolver:
+            nameserver.zone[("new.example.test", "A")] = [self.ips[0]]
+            resolver.zone[("new.example.test", "A")] = [self.ips[0]]
+            self.set_module_args(
+                {
+                    **self.correct_data,
+                    "name": "new",
+                    "wait_for_propagation": True,
+                    "propagation_timeout": 5,
+                    "propagation_nameservers": [nameserver.address],
+                    "propagation_resolvers": [resolver.address],
+                }
+            )
+
+            with self.assertRaises(AnsibleExitJson) as e:
+                dnsrecord.main()
+
+        create_dnsrecord_mock.assert_called_once()
+        self.assertEqual(
+            [nameserver.address, resolver.address],
+            e.exception.args[0]["propagation"]["servers"],
+        )
+
+    @mock.patch(f"{dnsrecord.__name__}.create_dnsrecord")
+    @mock.patch(f"{dnsrecord.__name__}.list_dnsrecord")
+    @mock.patch(f"{dnsrecord.__name__}.list_domains")
+    def test_propagation_failures(
+        self,
+        list_domains_mock: mock.Mock,
+        list_dnsrecord_mock: mock.Mock,
+        create_dnsrecord_mock: mock.Mock,
+    ):
+        list_domains_mock.return_value = list(self.domains.values())
+        list_dnsrecord_mock.return_value = list(self.main_domain_records)
+        completed = [{"method": "POST", "route": "record"}]
+
+        def create_dnsrecord(module, *args, **kwargs):
+            alwaysdata.task_state(module)["completed"].extend(completed)
+
+        create_dnsrecord_mock.side_effect = create_dnsrecord
+
+        with StubDNSServer() as nameserver:
+            data = {
+                **self.correct_data,
+                "name": "new",
+                "wait_for_propagation": True,
+                "propagation_timeout": 1,
+                "propagation_nameservers": [nameserver.address],
+            }
+
+            with self.subTest("Pending servers are reported with the applied writes"):
+                self.set_module_args(data)
+
+                with self.assertRaises(AnsibleFailJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual("Record was not propagated after 1s", e.exception.args[0]["msg"])
+                self.assertEqual([nameserver.address], e.exception.args[0]["pending"])
+                self.assertEqual(completed, e.exception.args[0]["completed"])
+
+            with self.subTest("A spent task timeout is reported as such"):
+                self.set_module_args({**data, "task_timeout": 0})
+
+                with self.assertRaises(AnsibleFailJson) as e:
+                    dnsrecord.main()
+
+                self.assertEqual(
+                    "Task timeout of 0 seconds exceeded before waiting for the propagation of "
+                    "new.example.test.",
+                    e.exception.args[0]["msg"],
+                )
+                self.assertEqual(completed, e.exception.args[0]["completed"])
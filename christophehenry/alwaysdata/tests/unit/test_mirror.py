@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from ansible.errors import AnsibleLookupError
+
+from ansible_collections.christophehenry.alwaysdata.plugins.lookup import mirror as mirror_lookup
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils.mirror import RecordMirror
+from ansible_collections.christophehenry.alwaysdata.plugins.modules import dnsrecord
+
+
+class TestRecordMirror(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "mirror.db")
+
+        self.domains = [
+            {"id": domain_id, "name": name, "href": f"/v1/domain/{domain_id}/"}
+            for domain_id, name in ((1234, "example.test"), (5678, "example2.test"))
+        ]
+        self.records = [
+            {
+                "id": 10000,
+                "domain": {"href": "/v1/domain/1234/"},
+                "type": "A",
+                "name": "git",
+                "value": "12.102.160.30",
+                "priority": None,
+                "ttl": 300,
+            },
+            {
+                "id": 10001,
+                "domain": {"href": "/v1/domain/1234/"},
+                "type": "CNAME",
+                "name": "git",
+                "value": "example2.test",
+                "priority": None,
+                "ttl": 300,
+            },
+            {
+                "id": 10002,
+                "domain": {"href": "/v1/domain/5678/"},
+                "type": "A",
+                "name": "www",
+                "value": "12.102.160.30",
+                "priority": None,
+                "ttl": 300,
+            },
+        ]
+
+        self.mirror = RecordMirror(self.path)
+        self.addCleanup(self.mirror.close)
+        self.mirror.sync_domains(self.domains)
+        self.mirror.sync_records(self.records)
+
+    def test_queries(self):
+        with self.subTest("Records pointing at an IP across domains"):
+            self.assertEqual(
+                [("example.test", 10000), ("example2.test", 10002)],
+                [(it["domain_name"], it["id"]) for it in self.mirror.query(value="12.102.160.30")],
+            )
+
+        with self.subTest("Names with both A and CNAME"):
+            self.assertEqual(
+                [("example.test", "git")], self.mirror.names_with_types(["A", "CNAME"])
+            )
+
+        self.assertTrue(self.mirror.is_fresh())
+
+    def test_write_through(self):
+        self.mirror.upsert_record(10000, domain=1234, type="A", name="git", value="12.102.160.31")
+        self.assertEqual([10000], [it["id"] for it in self.mirror.query(value="12.102.160.31")])
+
+        self.mirror.delete_record(10002)
+        self.assertEqual([], self.mirror.query(domain="example2.test"))
+
+        self.mirror.upsert_record(10003, domain=9999, type="A", name="git", value="12.102.160.31")
+        self.assertFalse(self.mirror.is_fresh())
+
+    def test_null_values(self):
+        self.mirror.sync_records([*self.records, {**self.records[0], "id": 10003, "value": None}])
+        self.assertEqual([10003], [it["id"] for it in self.mirror.query(value="")])
+
+    @mock.patch(f"{dnsrecord.__name__}.api_query")
+    def test_dnsrecord_write_through(self, api_query_mock: mock.Mock):
+        module = mock.Mock(params={"mirror": self.path})
+
+        dnsrecord.update_dnsrecord(
+            module, "token", 10000, domain=1234, type="A", name="git", value="12.102.160.32"
+        )
+        dnsrecord.delete_dnsrecord(module, "token", 10001)
+
+        with RecordMirror(self.path) as mirror:
+            self.assertEqual(
+                ["12.102.160.32"],
+                [it["value"] for it in mirror.query(domain="example.test", name="git")],
+            )
+
+            api_query_mock.return_value = None
+            dnsrecord.create_dnsrecord(
+                module, "token", domain=1234, type="A", name="new", value="12.102.160.32"
+            )
+            self.assertFalse(mirror.is_fresh())
+
+        with self.subTest("Mirror errors don't fail the task"):
+            self.mirror.sync_records(self.records)
+            with mock.patch.object(
+                RecordMirror,
+                "delete_record",
+                side_effect=sqlite3.OperationalError("database is locked"),
+            ):
+                dnsrecord.delete_dnsrecord(module, "token", 10002)
+
+            module.warn.assert_called_once()
+            self.assertFalse(self.mirror.is_fresh())
+
+    def lookup(self, **options):
+        lookup = mirror_lookup.LookupModule()
+        options = {"path": self.path, **options}
+        with (
+            mock.patch.object(lookup, "set_options"),
+            mock.patch.object(lookup, "get_option", side_effect=options.get),
+        ):
+            return lookup.run([])
+
+    def test_lookup(self):
+        self.assertEqual([10002], [it["id"] for it in self.lookup(domain="example2.test")])
+
+        with self.subTest("Stale mirrors aren't queried"):
+            self.mirror.invalidate_records()
+            with self.assertRaisesRegex(AnsibleLookupError, "is stale"):
+                self.lookup(domain="example2.test")
@@ -0,0 +1,58 @@
+import json
+import os
+import tempfile
+from unittest import mock
+
+from ansible_collections.christophehenry.alwaysdata.plugins.modules import snapshot
+
+from .utils import AlwaysDataTestModule, AnsibleExitJson
+
+
+class TestSnapshotModule(AlwaysDataTestModule):
+    def setUp(self):
+        super().setUp()
+        self.token = "n=w@j75(@@&0kfu1@e!0wmg_&87vht$i3cg@tl8sl%9_5&vo&!"
+        self.domains = [{"id": 1234, "name": "example.test", "href": "/v1/domain/1234/"}]
+        self.records = [
+            {
+                "id": 5678,
+                "domain": {"href": "/v1/domain/1234/"},
+                "type": "A",
+                "name": "git",
+                "value": "12.102.160.30",
+                "priority": None,
+                "ttl": 300,
+                "href": "/v1/record/5678/",
+                "annotation": "",
+            }
+        ]
+
+    @mock.patch(f"{snapshot.__name__}.list_records")
+    @mock.patch(f"{snapshot.__name__}.list_domains")
+    def test_snapshot(self, list_domains_mock: mock.Mock, list_records_mock: mock.Mock):
+        list_domains_mock.return_value = self.domains
+        list_records_mock.return_value = self.records
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            dest = os.path.join(tmpdir, "snapshot.json")
+
+            with self.subTest("Snapshot is written"):
+                self.set_module_args({"token": self.token, "dest": dest})
+                with self.assertRaises(AnsibleExitJson) as e:
+                    snapshot.main()
+
+                self.assertEqual(
+                    {"changed": True, "dest": dest, "domains": 1, "records": 1},
+                    e.exception.args[0],
+                )
+                with open(dest) as stream:
+                    self.assertEqual(
+                        {"version": 1, "domains": self.domains, "records": self.records},
+                        json.load(stream),
+                    )
+
+            with self.subTest("Identical snapshot is not rewritten"):
+                with self.assertRaises(AnsibleExitJson) as e:
+                    snapshot.main()
+
+                self.assertFalse(e.exception.args[0]["changed"])
@@ -0,0 +1,73 @@
+import unittest
+
+from ansible_collections.christophehenry.alwaysdata.plugins.module_utils import validation
+
+
+class TestValidation(unittest.TestCase):
+    def test_values(self):
+        valid = {
+            "A": "12.102.160.30",
+            "AAAA": "6b39:4323:4a95:8bd3:79fb:23da:a6b0:1dec",
+            "CNAME": "git.example.test.",
+            "MX": "mail.example.test",
+            "SRV": "5 5060 sip.example.test",
+            "CAA": '0 issue "letsencrypt.org"',
+            "DS": "60485 5 1 2BB183AF5F22588179A53B0A98631FAD1A292118",
+            "TXT": '"v=DKIM1; k=rsa; " "p=MIGfMA0GCSqGSIb3DQEBAQUAA4GN"',
+        }
+        invalid = {
+            "A": "6b39:4323:4a95:8bd3:79fb:23da:a6b0:1dec",
+            "AAAA": "12.102.160.30",
+            "CNAME": "-git.example.test",
+            "MX": "mail example test",
+            "SRV": "5 sip.example.test",
+            "CAA": "issue letsencrypt.org",
+            "DS": "60485 5 1 2BB183AF5F22",
+            "TXT": '"{}"'.format("a" * 256),
+        }
+
+        for rtype, value in valid.items():
+            with self.subTest(type=rtype, value=value):
+                self.assertEqual(
+                    [], validation.validate_record({"type": rtype, "value": value, "priority": 10})
+                )
+
+        for rtype, value in invalid.items():
+            with self.subTest(type=rtype, value=value):
+                self.assertEqual(
+                    1,
+                    len(validation.validate_record({"type": rtype, "value": value, "priority": 1})),
+                )
+
+    def test_arguments(self):
+        with self.subTest("name must match entirely"):
+            self.assertEqual(1, len(validation.validate_record({"name": "git#"})))
+
+        with self.subTest("Bounds"):
+            self.assertEqual(
+                [
+                    "'priority' argument must be between 0 and 65535.",
+                    "'ttl' argument must be between 0 and 2147483647.",
+                ],
+                validation.validate_record(
+                    {"type": "MX", "value": "mail.example.test", "priority": -1, "ttl": 2**31}
+                ),
+            )
+
+        with self.subTest("regex must compile"):
+            self.assertEqual(1, len(validation.validate_record({"regex": "("})))
+
+    def test_txt_chunks(self):
+        self.assertEqual([b"a" * 255, b"a" * 45], validation.txt_chunks("a" * 300))
+        self.assertEqual([b"v=spf1 ", b"-all"], validation.txt_chunks('"v=spf1 " "-all"'))
+
+    def test_validate_records(self):
+        self.assertEqual(
+            {1: ["'12.102.160' is not a valid IPv4 address."]},
+            validation.validate_records(
+                [
+                    {"type": "A", "value": "12.102.160.30"},
+                    {"type": "A", "value": "12.102.160"},
+                ]
+            ),
+        )
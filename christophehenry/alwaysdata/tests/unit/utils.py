@@ -1,4 +1,7 @@
 import json
+import socket
+import struct
+import threading
 import unittest
 from unittest.mock import patch
 
@@ -45,3 +48,64 @@ class AlwaysDataTestModule(unittest.TestCase):
     def set_module_args(self, args):
         args = json.dumps({"ANSIBLE_MODULE_ARGS": args})
         basic._ANSIBLE_ARGS = to_bytes(args)
+
+
+class StubDNSServer(threading.Thread):
+    """Authoritative-like UDP DNS server answering A, AAAA and TXT queries from ``self.zone``.
+
+    ``self.zone`` maps ``(name, type)`` to a list of values and can be changed while the server
+    is running to simulate propagation.
+    """
+
+    TYPES = {1: "A", 16: "TXT", 28: "AAAA"}
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.zone = {}
+        self.queries = 0
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.1)
+        self.address = "127.0.0.1:{}".format(self.socket.getsockname()[1])
+        self.running = True
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.running = False
+        self.join()
+        self.socket.close()
+
+    def run(self):
+        while self.running:
+            try:
+                data, client = self.socket.recvfrom(512)
+            except socket.timeout:
+                continue
+            self.queries += 1
+            self.socket.sendto(self.answer(data), client)
+
+    def answer(self, data):
+        query_id = struct.unpack_from("!H", data)[0]
+        offset, labels = 12, []
+        while data[offset]:
+            labels.append(data[offset + 1 : offset + 1 + data[offset]].decode())
+            offset += 1 + data[offset]
+        question = data[12 : offset + 5]
+        qtype = struct.unpack_from("!H", data, offset + 1)[0]
+
+        answers = b""
+        values = self.zone.get((".".join(labels), self.TYPES.get(qtype)), [])
+        for value in values:
+            if qtype == 1:
+                rdata = socket.inet_pton(socket.AF_INET, value)
+            elif qtype == 28:
+                rdata = socket.inet_pton(socket.AF_INET6, value)
+            else:
+                rdata = bytes([len(value)]) + value.encode()
+            answers += b"\xc0\x0c" + struct.pack("!HHIH", qtype, 1, 300, len(rdata)) + rdata
+
+        header = struct.pack("!HHHHHH", query_id, 0x8500, 1, len(values), 0, 0)
+        return header + question + answers